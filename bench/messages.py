@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+'''
+    Memory held by the Listener for a large number of received frames,
+    with full Message records and with MessageFilter compact records.
+    Each mode runs in its own process so RSS deltas do not mix.
+
+    usage: bench/messages.py [messages] [body size]
+'''
+
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'amq'))
+
+MODES = ['full', 'headers', 'digest']
+
+def headers(i):
+    return {'message-id': 'ID:vtb-generic-26.cern.ch-41234-1300000000000-3:1:1:1:%d' % i,
+            'destination': '/topic/monitor.test.network',
+            'timestamp': '1300000000%03d' % (i % 1000),
+            'expires': '0',
+            'priority': '4',
+            'subscription': '/subscription/1',
+            'persistent': 'true',
+            'monitor.test': 'testing-%d' % i,
+            'monitor.payload.size': '1024'}
+
+def measure(mode, messages, size):
+    from MultipleProducerConsumer import Listener, MessageFilter
+    from utils.Resources import ResourceSnapshot
+    message_filter = {'full': None,
+                      'headers': MessageFilter(['message-id', 'monitor.*']),
+                      'digest': MessageFilter(['message-id', 'monitor.*'], digest=True)}[mode]
+    listener = Listener(messages, message_filter=message_filter)
+    before = ResourceSnapshot().rss
+    for i in xrange(messages):
+        # a new body string per frame, as stomp.py hands them over
+        listener.on_message(headers(i), ('%d' % i).ljust(size, 'x'))
+    after = ResourceSnapshot().rss
+    return after - before
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1 and sys.argv[1] == '--mode':
+        print measure(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+        sys.exit(0)
+
+    messages = len(sys.argv) > 1 and int(sys.argv[1]) or 100000
+    size = len(sys.argv) > 2 and int(sys.argv[2]) or 1024
+    print '%d messages of %d bytes' % (messages, size)
+    for mode in MODES:
+        output = subprocess.Popen([sys.executable, __file__, '--mode', mode, '%d' % messages, '%d' % size],
+                                  stdout=subprocess.PIPE).communicate()[0]
+        kb = int(output.strip())
+        print '%-8s %8d KB %8.1f bytes/message' % (mode, kb, kb * 1024.0 / messages)
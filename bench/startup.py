@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+'''
+    Time to first byte of every check script, the time from the start
+    of the process to the first byte it writes. --version measures the
+    plain startup, no arguments measures the way to an argument error.
+
+    usage: bench/startup.py [runs]
+'''
+
+import glob
+import os
+import subprocess
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+MODES = [('version', ['--version']),
+         ('no args', [])]
+
+def interpreter(script):
+    f = open(script, 'r')
+    try:
+        shebang = f.readline()
+    finally:
+        f.close()
+    if 'python' in shebang:
+        return [sys.executable]
+    if 'perl' in shebang:
+        return ['perl']
+    return []
+
+def first_byte(command, env):
+    '''
+        Seconds until the process writes its first byte, None if it
+        writes nothing
+    '''
+    start = time.time()
+    process = subprocess.Popen(command,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT,
+                               env=env)
+    data = process.stdout.read(1)
+    elapsed = time.time() - start
+    process.communicate()
+    if not data:
+        return None
+    return elapsed
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) / 2]
+
+if __name__ == '__main__':
+
+    runs = len(sys.argv) > 1 and int(sys.argv[1]) or 10
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([SRC] + [p for p in [env.get('PYTHONPATH')] if p])
+    print '%-28s %-8s %10s %10s' % ('entry point', 'mode', 'min ms', 'median ms')
+    for script in sorted(glob.glob(os.path.join(SRC, 'check_activemq_*'))):
+        for mode, args in MODES:
+            times = [first_byte(interpreter(script) + [script] + args, env) for i in range(runs)]
+            times = [t for t in times if t is not None]
+            if not times:
+                print '%-28s %-8s %10s %10s' % (os.path.basename(script), mode, '-', '-')
+                continue
+            print '%-28s %-8s %10.1f %10.1f' % (os.path.basename(script), mode,
+                                                min(times) * 1000, median(times) * 1000)
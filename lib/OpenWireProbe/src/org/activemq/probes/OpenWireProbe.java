@@ -18,7 +18,16 @@ package org.activemq.probes;
 
 import java.io.File;
 import java.io.IOException;
+import java.util.ArrayList;
 import java.util.Arrays;
+import java.util.List;
+import java.util.concurrent.Callable;
+import java.util.concurrent.ExecutionException;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+import java.util.concurrent.Future;
+import java.util.concurrent.TimeUnit;
+import java.util.concurrent.TimeoutException;
 
 import javax.jms.Connection;
 import javax.jms.DeliveryMode;
@@ -41,9 +50,12 @@ import org.apache.activemq.util.IndentPrinter;
 /*
  * /usr/bin/java -classpath ".:/opt/activemq/lib/*:/opt/nagios/plugins/openwire" OpenWireProbe  --url=ssl://vtb-generic-16:6167 --subject="testopenwiressl" --ks=/etc/mycerts/mycert.ks --kstype="jks" --ts="/etc/mycerts/broker.ts" --kspwd="password"
  * /usr/bin/java -classpath ".:/opt/activemq/lib/*:/opt/nagios/plugins/openwire" OpenWireProbe  --url=tcp://vtb-generic-16:6166 --subject="testopenwire"
+ *
+ * Batch mode, all targets probed concurrently in one JVM under a shared deadline:
+ * /usr/bin/java -classpath ".:/opt/activemq/lib/*:/opt/nagios/plugins/openwire" OpenWireProbe  --url=tcp://vtb-generic-16:6166 --url=tcp://vtb-generic-17:6166 --subject="testopenwire" --timeout=10
  */
 
-public class OpenWireProbe implements MessageListener, ExceptionListener {
+public class OpenWireProbe implements MessageListener, ExceptionListener, Callable<Integer> {
     public static int NAGIOS_OK = 0;
     public static int NAGIOS_WARNING = 1;
     public static int NAGIOS_CRITICAL = 2;
@@ -75,12 +87,20 @@ public class OpenWireProbe implements MessageListener, ExceptionListener {
     private String ksType = "jks"; // pkcs12
     private String username = null;
     private String password = null;
+    private List<String> urls = new ArrayList<String>();
+    private List<String> subjects = new ArrayList<String>();
+    private long timeout = 0; // seconds, shared deadline in batch mode
+    private int threads = 8;
+    private boolean batch = false;
     
     private boolean sent = false;
     private boolean received = false;
     private int returnCode = NAGIOS_UNKNOWN;
+    private String result = "";
+    private long elapsed = 0;
     
-    private Connection connection = null;
+    // closed from the main thread when the target times out
+    private volatile Connection connection = null;
 
     public static void main(String[] args) {
         OpenWireProbe prober = new OpenWireProbe();
@@ -89,16 +109,167 @@ public class OpenWireProbe implements MessageListener, ExceptionListener {
             System.out.println("UNKNOWN - options: " + Arrays.toString(unknown));
             System.exit(NAGIOS_UNKNOWN);
         }
-        prober.run();
+        if (prober.urls.size() > 1 || prober.subjects.size() > 1) {
+            prober.runBatch();
+        } else {
+            prober.run();
+        }
     }
     
 
     public void run() {
+        setSslEnv();
+        probe();
+        System.out.println(result);
+        System.exit(returnCode);
+    }
+
+    public Integer call() {
+        return probe();
+    }
+
+    /**
+     * Probes every (url, subject) target concurrently and prints one
+     * summary line with perfdata followed by one line per target.
+     */
+    public void runBatch() {
+        List<OpenWireProbe> targets;
+        try {
+            targets = createTargets();
+        } catch (IllegalArgumentException e) {
+            System.out.println("UNKNOWN - " + e.getMessage());
+            System.exit(NAGIOS_UNKNOWN);
+            return;
+        }
+
+        setSslEnv();
+
+        long started = System.currentTimeMillis();
+        long deadline = started + timeout * 1000;
+        ExecutorService executor = Executors.newFixedThreadPool(Math.min(threads, targets.size()));
+        List<Future<Integer>> futures = new ArrayList<Future<Integer>>();
+        for (OpenWireProbe target : targets) {
+            futures.add(executor.submit((Callable<Integer>)target));
+        }
+
+        // Outcomes are kept here, a worker still blocked after its
+        // timeout may write its own fields at any time
+        int[] codes = new int[targets.size()];
+        String[] results = new String[targets.size()];
+        long[] times = new long[targets.size()];
+        for (int i = 0; i < targets.size(); i++) {
+            OpenWireProbe target = targets.get(i);
+            Future<Integer> future = futures.get(i);
+            try {
+                if (timeout > 0) {
+                    codes[i] = future.get(Math.max(0, deadline - System.currentTimeMillis()), TimeUnit.MILLISECONDS);
+                } else {
+                    codes[i] = future.get();
+                }
+                // the worker is done, its fields are visible once get() returned
+                results[i] = target.result;
+                times[i] = target.elapsed;
+            } catch (TimeoutException e) {
+                future.cancel(true);
+                target.close();
+                codes[i] = NAGIOS_CRITICAL;
+                results[i] = "timeout after " + timeout + " seconds";
+                times[i] = timeout * 1000;
+            } catch (InterruptedException e) {
+                future.cancel(true);
+                target.close();
+                codes[i] = NAGIOS_CRITICAL;
+                results[i] = "interrupted";
+                times[i] = System.currentTimeMillis() - started;
+            } catch (ExecutionException e) {
+                codes[i] = NAGIOS_CRITICAL;
+                results[i] = "" + e.getCause();
+                times[i] = System.currentTimeMillis() - started;
+            }
+        }
+        executor.shutdownNow();
+
+        int code = NAGIOS_OK;
+        int ok = 0;
+        StringBuilder perfdata = new StringBuilder();
+        StringBuilder details = new StringBuilder();
+        for (int i = 0; i < targets.size(); i++) {
+            OpenWireProbe target = targets.get(i);
+            code = worst(code, codes[i]);
+            if (codes[i] == NAGIOS_OK) {
+                ok++;
+            }
+            perfdata.append(String.format(" t%d_time=%.3fs;;;0 t%d_status=%d;1;2;0;3",
+                    i + 1, times[i] / 1000.0, i + 1, codes[i]));
+            details.append(String.format("%nt%d %s %s: %s (%.3fs)",
+                    i + 1, target.url, target.subject, results[i], times[i] / 1000.0));
+        }
+        System.out.println(ok + " of " + targets.size() + " targets working |" + perfdata + details);
+        System.exit(code);
+    }
+
+    /**
+     * Pairs urls with subjects. Lists of equal length are zipped, a single
+     * url or subject is combined with every element of the other list.
+     */
+    protected List<OpenWireProbe> createTargets() {
+        int nurls = urls.size();
+        int nsubjects = subjects.size();
+        if (nurls == 0) {
+            urls.add(url);
+            nurls = 1;
+        }
+        if (nsubjects == 0) {
+            subjects.add(subject);
+            nsubjects = 1;
+        }
+        if (nurls != nsubjects && nurls != 1 && nsubjects != 1) {
+            throw new IllegalArgumentException("cannot pair " + nurls + " urls with " + nsubjects + " subjects");
+        }
+        List<OpenWireProbe> targets = new ArrayList<OpenWireProbe>();
+        for (int i = 0; i < Math.max(nurls, nsubjects); i++) {
+            targets.add(copy(urls.get(nurls == 1 ? 0 : i), subjects.get(nsubjects == 1 ? 0 : i)));
+        }
+        return targets;
+    }
+
+    protected OpenWireProbe copy(String targetUrl, String targetSubject) {
+        OpenWireProbe target = new OpenWireProbe();
+        target.url = targetUrl;
+        target.subject = targetSubject;
+        target.batch = true;
+        target.verbose = verbose;
+        target.topic = topic;
+        target.transacted = transacted;
+        target.durable = durable;
+        target.consumerName = consumerName;
+        target.ackMode = ackMode;
+        target.receiveTimeOut = receiveTimeOut;
+        target.timeToLive = timeToLive;
+        target.persistent = persistent;
+        target.username = username;
+        target.password = password;
+        return target;
+    }
+
+    protected static int worst(int a, int b) {
+        // CRITICAL outranks UNKNOWN when aggregating
+        int[] severity = {0, 1, 3, 2};
+        return severity[a] >= severity[b] ? a : b;
+    }
+
+    protected void close() {
+        try {
+            connection.close();
+        } catch (Throwable ignore) {
+        }
+    }
+
+    public int probe() {
+        long start = System.currentTimeMillis();
         try {
             running = true;
 
-            setSslEnv();
-            
             ActiveMQConnectionFactory connectionFactory = new ActiveMQConnectionFactory(url);
             connection = connectionFactory.createConnection(username, password);
             connection.setExceptionListener(this);
@@ -151,32 +322,32 @@ public class OpenWireProbe implements MessageListener, ExceptionListener {
                 consumeMessagesAndClose(connection, session, consumer, receiveTimeOut);
             }
             
-            if(received && sent){
-            	System.out.println("connection works: sent and received 1 messages");
+            if (returnCode == NAGIOS_CRITICAL) {
+                // failure already reported by onMessage or onException
+            } else if(received && sent){
+            	result = "connection works: sent and received 1 messages";
             	returnCode = NAGIOS_OK;
             }else if(sent){
-            	System.out.println("sent 1 message, received 0 messages");
+            	result = "sent 1 message, received 0 messages";
             	returnCode = NAGIOS_WARNING;
             }else{
-            	System.out.println("sent and received 0 messages");
+            	result = "sent and received 0 messages";
             	returnCode = NAGIOS_CRITICAL;
             }
 
         } catch (JMSException e) {
-        	System.out.println("" + e);
+        	result = "" + e;
             if(verbose) e.printStackTrace();
             returnCode = NAGIOS_CRITICAL;
         } catch (Exception e) {
-            System.out.println("" + e);
+            result = "" + e;
             if(verbose) e.printStackTrace();
             returnCode = NAGIOS_CRITICAL;
         } finally {
-            try {
-                connection.close();
-            } catch (Throwable ignore) {
-            }
+            close();
+            elapsed = System.currentTimeMillis() - start;
         }
-        System.exit(returnCode);
+        return returnCode;
     }
 
 
@@ -249,6 +420,11 @@ public class OpenWireProbe implements MessageListener, ExceptionListener {
             }
 
         } catch (JMSException e) {
+            if (batch) {
+                result = "CRITICAL: " + e;
+                returnCode = NAGIOS_CRITICAL;
+                return;
+            }
         	System.out.println("CRITICAL: " + e);
             System.out.println("Caught: " + e);
             e.printStackTrace();
@@ -257,7 +433,10 @@ public class OpenWireProbe implements MessageListener, ExceptionListener {
     }
 
     public synchronized void onException(JMSException ex) {
-        System.out.println("CRITICAL - JMS Exception occured.  Shutting down client.");
+        if (!batch) {
+            System.out.println("CRITICAL - JMS Exception occured.  Shutting down client.");
+        }
+        result = "JMS Exception occured: " + ex;
         returnCode = NAGIOS_CRITICAL;
         running = false;
     }
@@ -306,6 +485,15 @@ public class OpenWireProbe implements MessageListener, ExceptionListener {
 
     public void setSubject(String subject) {
         this.subject = subject;
+        this.subjects.add(subject);
+    }
+
+    public void setTimeout(long timeout) {
+        this.timeout = timeout;
+    }
+
+    public void setThreads(int threads) {
+        this.threads = Math.max(1, threads);
     }
     
     public void setTs(String ts) {
@@ -350,6 +538,7 @@ public class OpenWireProbe implements MessageListener, ExceptionListener {
 
     public void setUrl(String url) {
         this.url = url;
+        this.urls.add(url);
     }
 
     public void setVerbose(boolean verbose) {
@@ -3,10 +3,12 @@
 # Massimo Paladin
 # Massimo.Paladin@cern.ch
 
-import commands
 import os
+import socket
 import time
 from MultipleProducerConsumer import MultipleProducerConsumer, TimeoutException
+from Ping import PingTest
+from utils.ClockSkew import ClockSkewEstimator
 from utils.Timer import Timer
 
 import logging
@@ -20,7 +22,22 @@ MONITOR_TEST_CLIENTNAME = MONITOR_TEST_HEADER + '.clientname'
 MONITOR_EXPIRY_TIME = 86400 * 1000 # 1 Day
 
 def uuidgen():
-    return commands.getoutput('uuidgen')
+    # the uuid module forks ldconfig when imported on Python 2
+    return os.urandom(16).encode('hex')
+
+def probeHeaders(seq_id, sending_time, replyto, destclientname, serverid):
+    '''
+        Headers of a probe the consumer service answers on replyto
+    '''
+    return { 'expires': int(sending_time * 1000 + 
+                            MONITOR_EXPIRY_TIME),
+             'persistent':'true',
+             'receipt' : 'consumer_service_%s' % seq_id,
+             'reply-to':'%s' % replyto, 
+             MONITOR_TEST_CLIENTNAME:'%s' % destclientname,
+             MONITOR_TEST_SERVERID:'%s' % serverid,
+             MONITOR_TEST_HEADER:'%s' % seq_id,
+             MONITOR_TEST_TIME_HEADER:'%f' % sending_time }
 
 class ConsumerServiceSender(MultipleProducerConsumer):
     
@@ -65,16 +82,10 @@ class ConsumerServiceSender(MultipleProducerConsumer):
         sending_time = timer.time()
         self.sendMessage(self.brokerName, 
                          self.destination, 
-                         { 'expires': int(sending_time * 1000 + 
-                                        MONITOR_EXPIRY_TIME),
-                            'persistent':'true',
-                            'receipt' : 'consumer_service_%s' % seq_id,
-                            'reply-to':'%s' % self.replyto, 
-                            MONITOR_TEST_CLIENTNAME:'%s' % self.destclientname,
-                            MONITOR_TEST_SERVERID:'%s' % self.serverid,
-                            MONITOR_TEST_HEADER:'%s' % seq_id,
-                            MONITOR_TEST_TIME_HEADER:'%f' % sending_time }, 
-                         'testing consumer service!')
+                         probeHeaders(seq_id, sending_time, self.replyto,
+                                      self.destclientname, self.serverid), 
+                         'testing consumer service!',
+                         timeout=timer.left)
         self.waitForMessagesToBeSent(self.brokerName,
                                      self.destination,
                                      timer.left)
@@ -98,8 +109,11 @@ class ConsumerServiceReceiver(MultipleProducerConsumer):
                  hostcert=None, 
                  hostkey=None,
                  logfile='/tmp/monitor.test.consumerService_dev',
+                 peer=None,
+                 pingdestination=None,
                  port=6163, 
                  serverid='opsmonitor_dev',
+                 skewfile=None,
                  timeout=15,
                  warning=30,
                  **opts):
@@ -113,12 +127,17 @@ class ConsumerServiceReceiver(MultipleProducerConsumer):
         self.hostcert = hostcert
         self.hostkey = hostkey
         self.logfile = logfile
+        self.peer = peer or destclientname
+        self.pingdestination = pingdestination
         self.port = port
         self.serverid = serverid
+        self.skewfile = skewfile
         self.timeout = timeout
         self.warning = warning
         
         self.avgDelay = None
+        self.delayError = None
+        self.skew = None
         self.results = dict()
         
     def getAvgDelay(self):
@@ -128,16 +147,24 @@ class ConsumerServiceReceiver(MultipleProducerConsumer):
     def getResults(self):
         return self.results
     results = property(getResults)
+    
+    def getDelayError(self):
+        '''
+            Error bound of the clock skew correction, None if not corrected
+        '''
+        return self.delayError
         
     def setup(self):
         
         if self.hostcert and self.hostkey:
             self.setSSLAuthentication(self.hostcert, self.hostkey)
+        self.setMessageFilter([MONITOR_TEST_HEADER + '*'], digest=True)
         self.createBroker(self.brokerName, self.brokerHost, self.port)
         
     def run(self):
         
         timer = Timer(self.timeout)
+        self.estimateSkew(timer)
         
         ''' Starting consumer '''
         self.createConsumer(self.brokerName, self.destination, timer.left)
@@ -151,6 +178,42 @@ class ConsumerServiceReceiver(MultipleProducerConsumer):
         self.writeNewLog()
         
         
+    def skewPair(self):
+        return '%s|%s' % (socket.getfqdn(), self.peer)
+        
+    def estimateSkew(self, timer):
+        '''
+            Measure the clock offset of the consumer service host with pings
+            answered by a responder running next to it, and keep the
+            smoothed offset of this host pair in the skew file
+        '''
+        if not self.skewfile:
+            return
+        self.skew = ClockSkewEstimator(self.skewfile)
+        if self.pingdestination:
+            pt = PingTest(self.brokerName, self.brokerHost,
+                          count=5,
+                          destination=self.pingdestination,
+                          hostcert=self.hostcert,
+                          hostkey=self.hostkey,
+                          interval=0.05,
+                          port=self.port,
+                          replytimeout=1,
+                          timeout=timer.left / 3)
+            for key, value in self._connection_extra_headers.items():
+                pt.setConnectionExtraHeaders(key, value)
+            pt.setup()
+            try:
+                pt.start()
+            except TimeoutException, e:
+                log.info('Clock skew not measured: %s' % e)
+            pt.stop()
+            self.skew.update(self.skewPair(), pt.samples)
+        estimate = self.skew.get(self.skewPair())
+        if estimate:
+            log.info('Clock offset of %s: %.3fs +/- %.3fs' % (self.peer, estimate[0], estimate[1]))
+            self.delayError = estimate[1]
+        
     def readLog(self):
         ''' Read logged values and look for the youngest value received that appear in the logfile '''
         try:
@@ -161,6 +224,7 @@ class ConsumerServiceReceiver(MultipleProducerConsumer):
         delays = []
         self.logged = dict()
         self.youngestLogged = 0
+        self.results['negative'] = 0
         log.debug('received: %s' % self.received)
         for line in f:
             l = [v.strip() for v in line.split(' ')]
@@ -168,8 +232,7 @@ class ConsumerServiceReceiver(MultipleProducerConsumer):
                 self.logged[l[1]] = float(l[0])
                 if (l[1] in self.received):
                     log.debug('timing: %2f %2f' % (float(self.logged[l[1]]), self.received[l[1]]))
-                    delays.append( max( 
-                            self.received[l[1]] - float(self.logged[l[1]]), 0.0 ) )
+                    delays.append(self.delayOf(float(self.logged[l[1]]), self.received[l[1]]))
                     if (self.logged[l[1]] > self.youngestLogged):
                         self.youngestLogged = self.logged[l[1]]
                 log.debug('%d %s' % (self.logged[l[1]], l[1]))
@@ -178,6 +241,23 @@ class ConsumerServiceReceiver(MultipleProducerConsumer):
         if delays:
             self.avgDelay = sum(delays, 0.0) / len(delays)
         
+    def delayOf(self, sent, replied):
+        '''
+            Delay of a reply, corrected for the clock skew if measured,
+            negative delays are counted in results
+        '''
+        corrected = self.skew is not None and self.delayError is not None
+        if corrected:
+            delay = self.skew.correct(self.skewPair(), replied) - sent
+        else:
+            delay = replied - sent
+        if delay < 0:
+            self.results['negative'] += 1
+        if not corrected:
+            # uncorrected clocks, a negative delay is only skew
+            delay = max(delay, 0.0)
+        return delay
+        
     def writeNewLog(self):
         ''' 
         Rewrite logfile without the received and the old values, 
@@ -197,10 +277,10 @@ class ConsumerServiceReceiver(MultipleProducerConsumer):
                 self.results['old'] += 1
             elif val > self.youngestLogged:
                 ''' Check age and increase number of warning and critical values '''
-                if (now - val) > (self.warning * 60):
-                    self.results['warning'] += 1
-                elif  (now - val) > (self.critical * 60):
+                if (now - val) > (self.critical * 60):
                     self.results['critical'] += 1
+                elif (now - val) > (self.warning * 60):
+                    self.results['warning'] += 1
                 ''' Rewrite value in logfile '''
                 f.write('%f %s\n' % (val, k))
                 log.debug('Writing %d %s' % (val, k))
@@ -216,6 +296,145 @@ class ConsumerServiceReceiver(MultipleProducerConsumer):
                nms[headers[MONITOR_TEST_HEADER].strip()] = \
                     float(headers.get(MONITOR_TEST_TIME_HEADER, 0))
         return nms
+    
+class ConsumerServicePipeline(ConsumerServiceReceiver):
+    '''
+        Sender and receiver of the consumer service test on a single
+        connection. Each cycle sends a probe on the connection consuming
+        the replies, matches the replies to the probes of this and the
+        earlier cycles in memory and reads and writes the log file once.
+    '''
+    
+    def __init__(self, brokerName, brokerHost, 
+                 destination='/queue/monitor.test.consumerService',
+                 quiet=0.5,
+                 replyto='/queue/monitor.test.consumerService', 
+                 **opts):
+        ConsumerServiceReceiver.__init__(self, brokerName, brokerHost, destination=replyto, **opts)
+        
+        self.sendDestination = destination
+        self.quiet = quiet
+        self.replyto = replyto
+        
+        self.received = dict()
+        self.inflight = dict()
+        self.lastReply = None
+        
+    def getInflight(self):
+        '''
+            Age in seconds of every probe still waiting for its reply
+        '''
+        return self.inflight
+        
+    def run(self):
+        
+        timer = Timer(self.timeout)
+        self.estimateSkew(timer)
+        probes = self.loadProbes()
+        
+        try:
+            ''' Starting consumer, replies are matched as they arrive '''
+            self.createConsumer(self.brokerName, self.replyto, timer.left)
+            self.setMessageHandler(self.brokerName, self.replyto, self.collect)
+            
+            ''' Sending this cycle's probe on the consumer connection '''
+            seq_id = uuidgen()
+            sending_time = timer.time()
+            self.sendMessage(self.brokerName, 
+                             self.sendDestination, 
+                             probeHeaders(seq_id, sending_time, self.replyto,
+                                          self.destclientname, self.serverid), 
+                             'testing consumer service!',
+                             via=self.replyto,
+                             timeout=timer.left)
+            ''' Recorded once sent, even if the receipt never comes '''
+            probes[seq_id] = sending_time
+            self.waitForMessagesToBeSent(self.brokerName,
+                                         self.replyto,
+                                         timer.left)
+            
+            ''' Draining replies until none arrived for quiet seconds '''
+            while timer.left > 0 and seq_id not in self.received:
+                last = self.lastReply or sending_time
+                if timer.time() - last >= self.quiet:
+                    break
+                timer.sleep(0.05)
+        finally:
+            ''' Replies are auto-acked, the ones consumed so far are matched and the probes kept whatever happened '''
+            self.match(probes)
+        
+    def collect(self, headers, body):
+        if MONITOR_TEST_HEADER in headers \
+                and headers.get(MONITOR_TEST_CLIENTNAME, '') == self.destclientname \
+                and headers.get(MONITOR_TEST_SERVERID, '') == self.serverid:
+            self.received[headers[MONITOR_TEST_HEADER].strip()] = \
+                float(headers.get(MONITOR_TEST_TIME_HEADER, 0))
+            self.lastReply = time.time()
+        
+    def match(self, probes):
+        '''
+            Compute the delays of the answered probes, count the probes
+            overtaken by a younger answered one as old and keep the
+            others in flight with their age
+        '''
+        received = dict(self.received)
+        delays = []
+        youngest = 0
+        self.results['negative'] = 0
+        for seq, replied in received.items():
+            if seq in probes:
+                delays.append(self.delayOf(probes[seq], replied))
+                youngest = max(youngest, probes[seq])
+        self.results['received'] = len(received)
+        self.results['old'] = 0
+        self.results['warning'] = 0
+        self.results['critical'] = 0
+        now = time.time()
+        remaining = dict()
+        for seq, sent in probes.items():
+            if seq in received:
+                continue
+            if sent < youngest:
+                self.results['old'] += 1
+                continue
+            remaining[seq] = sent
+            self.inflight[seq] = now - sent
+            if (now - sent) > (self.critical * 60):
+                self.results['critical'] += 1
+            elif (now - sent) > (self.warning * 60):
+                self.results['warning'] += 1
+        self.results['inflight'] = len(self.inflight)
+        self.results['oldest'] = max(self.inflight.values() or [0.0])
+        if delays:
+            self.avgDelay = sum(delays, 0.0) / len(delays)
+        self.saveProbes(remaining)
+        
+    def loadProbes(self):
+        '''
+            Probes in flight from earlier cycles, sequence id to sending time
+        '''
+        probes = dict()
+        if not os.path.exists(self.logfile):
+            return probes
+        try:
+            f = open(self.logfile, 'r')
+        except IOError:
+            raise IOError("Error opening log file")
+        for line in f:
+            l = [v.strip() for v in line.split(' ')]
+            if len(l) == 2:
+                probes[l[1]] = float(l[0])
+        f.close()
+        return probes
+        
+    def saveProbes(self, probes):
+        try:
+            f = open(self.logfile, 'w')
+        except IOError:
+            raise IOError("Error opening log file")
+        for seq, sent in probes.items():
+            f.write('%f %s\n' % (sent, seq))
+        f.close()
             
 if __name__ == '__main__':
 
@@ -248,4 +467,17 @@ if __name__ == '__main__':
         print '%s' % e
     mcr.stop()
     
+    mcp = ConsumerServicePipeline(broker, brokerHost, port=6163)
+    mcp.setup()
+    try:
+        mcp.start()
+    except IOError, e:
+        print '%s' % e
+    except KeyboardInterrupt:
+        print "keyboard interrupt"
+    except TimeoutException, e:
+        print '%s' % e
+    mcp.stop()
+    print 'In flight: %s' % mcp.getInflight()
+    
     print 'Test passed!'
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+import json
+import os
+import re
+import time
+from MultipleProducerConsumer import MultipleProducerConsumer, TimeoutException
+from utils.Timer import Timer
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__file__)
+
+STATISTICS_DESTINATION = '/queue/ActiveMQ.Statistics.Destination.>'
+BROKER_STATISTICS_DESTINATION = '/queue/ActiveMQ.Statistics.Broker'
+REPLY_DESTINATION = '/temp-queue/monitor.statistics'
+
+def parseMapMessage(body):
+    '''
+        Convert a MapMessage transformed with jms-map-json into a dict
+    '''
+    entries = json.loads(body).get('map', {}).get('entry', [])
+    if isinstance(entries, dict):
+        entries = [entries]
+    values = dict()
+    for entry in entries:
+        key = entry.get('string')
+        if isinstance(key, list):
+            # string values are given as [key, value]
+            values[key[0]] = key[1]
+            continue
+        for k, v in entry.items():
+            if k != 'string':
+                values[key] = v
+    return values
+
+class DestinationStatistics(MultipleProducerConsumer):
+    '''
+        Ask the ActiveMQ statistics plugin for the statistics of every
+        destination with one request and keep them in a table
+    '''
+
+    def __init__(self, brokerName, brokerHost, port=6163, destination=STATISTICS_DESTINATION, hostcert=None, hostkey=None, timeout=15, quiet=0.5, statefile=None, bufferSize=10000):
+        MultipleProducerConsumer.__init__(self)
+
+        self.brokerName = brokerName
+        self.brokerHost = brokerHost
+        self.port = port
+        self.destination = destination
+        self.hostcert = hostcert
+        self.hostkey = hostkey
+        self.timeout = timeout
+        self.quiet = quiet
+        self.statefile = statefile
+        self.bufferSize = bufferSize
+
+        self.table = dict()
+
+    def setup(self):
+
+        if self.hostcert and self.hostkey:
+            self.setSSLAuthentication(self.hostcert, self.hostkey)
+        self.setBufferSize(self.bufferSize)
+        self.createBroker(self.brokerName, self.brokerHost, self.port)
+
+    def run(self):
+
+        timer = Timer(self.timeout)
+
+        ''' Subscribing to the temporary reply queue, MapMessages converted to JSON '''
+        self.createConsumer(self.brokerName, REPLY_DESTINATION, timer.left,
+                            {'transformation': 'jms-map-json'})
+
+        ''' Sending the request on the same connection so the broker can reply '''
+        self.sendMessage(self.brokerName,
+                         self.destination,
+                         {'persistent':'false',
+                          'reply-to':REPLY_DESTINATION},
+                         '',
+                         via=REPLY_DESTINATION,
+                         timeout=timer.left)
+
+        ''' Collecting replies until the broker goes quiet '''
+        self.waitForMessagesToArrive(self.brokerName, REPLY_DESTINATION, 1, timer.left)
+        received = 0
+        while timer.left > 0:
+            timer.sleep(self.quiet)
+            count = len(self.getMessages(self.brokerName, REPLY_DESTINATION))
+            if count == received:
+                break
+            received = count
+        if received >= self.bufferSize:
+            log.info('Reply buffer full, statistics of some destinations dropped')
+
+        now = timer.time()
+        for message in self.getMessages(self.brokerName, REPLY_DESTINATION):
+            try:
+                values = parseMapMessage(message.body)
+            except ValueError, e:
+                log.info('Cannot parse statistics reply: %s' % e)
+                continue
+            name = values.get('destinationName', values.get('brokerName'))
+            if name:
+                self.table[name] = values
+        self.computeRates(now)
+
+    def computeRates(self, now):
+        '''
+            Derive enqueue/dequeue rates from the counts stored by the previous run
+        '''
+        if not self.statefile:
+            return
+        previous = dict()
+        try:
+            f = open(self.statefile, 'r')
+            try:
+                previous = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            pass
+        for name, values in self.table.items():
+            if name not in previous:
+                continue
+            last = previous[name]
+            elapsed = now - last['time']
+            if elapsed <= 0:
+                continue
+            for count, rate in (('enqueueCount', 'enqueueRate'), ('dequeueCount', 'dequeueRate')):
+                if count in values and count in last:
+                    values[rate] = max(float(values[count]) - float(last[count]), 0.0) / elapsed
+        state = dict()
+        for name, values in self.table.items():
+            state[name] = {'time': now,
+                           'enqueueCount': values.get('enqueueCount', 0),
+                           'dequeueCount': values.get('dequeueCount', 0)}
+        try:
+            f = open(self.statefile, 'w')
+            try:
+                json.dump(state, f)
+            finally:
+                f.close()
+        except IOError, e:
+            log.info('Cannot write state file: %s' % e)
+
+    def getTable(self, include=None, exclude=None):
+        '''
+            Return the statistics of the destinations whose names match
+            the include regex and do not match the exclude regex
+        '''
+        table = dict()
+        for name, values in self.table.items():
+            if include and not re.search(include, name):
+                continue
+            if exclude and re.search(exclude, name):
+                continue
+            table[name] = values
+        return table
+
+    def evaluate(self, table, warningSize=None, criticalSize=None, minConsumers=None):
+        '''
+            Check every destination of the table against the thresholds,
+            return the (name, state, reason) of those breaching them,
+            state 1 for warning and 2 for critical
+        '''
+        problems = []
+        for name in sorted(table):
+            values = table[name]
+            size = int(values.get('size', 0))
+            consumers = int(values.get('consumerCount', 0))
+            if criticalSize is not None and size >= criticalSize:
+                problems.append((name, 2, 'size %d >= %d' % (size, criticalSize)))
+            elif warningSize is not None and size >= warningSize:
+                problems.append((name, 1, 'size %d >= %d' % (size, warningSize)))
+            if minConsumers is not None and consumers < minConsumers:
+                problems.append((name, 2, 'consumers %d < %d' % (consumers, minConsumers)))
+        return problems
+
+if __name__ == '__main__':
+
+    log.setLevel(logging.INFO)
+    logging.getLogger('MultipleProducerConsumer').setLevel(logging.INFO)
+    broker = 'gridmsg001'
+    brokerHost = 'gridmsg001.cern.ch'
+
+    ds = DestinationStatistics(broker, brokerHost, 6163)
+    ds.setup()
+
+    try:
+        ds.start()
+    except KeyboardInterrupt:
+        print "keyboard interrupt"
+    except TimeoutException, e:
+        print '%s' % e
+    ds.stop()
+
+    for name, values in sorted(ds.table.items()):
+        print '%s: size=%s consumers=%s' % (name, values.get('size'), values.get('consumerCount'))
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+import threading
+import time
+from MultipleProducerConsumer import MultipleProducerConsumer, TimeoutException, MONITOR_RUN_HEADER
+from utils.Payload import PayloadPool
+from utils.Stats import summary
+from utils.Timer import Timer
+
+import logging
+logging.basicConfig()
+log = logging.getLogger("LoadGenerator")
+
+LOAD_HEADER = 'monitor.load'
+LOAD_SENT_HEADER = LOAD_HEADER + '.sent'
+LOAD_PRODUCER_HEADER = LOAD_HEADER + '.producer'
+
+class WorkerStats(object):
+    '''
+        Counters of one producer or consumer, only touched by its own
+        thread so no locking is needed until aggregation
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.first = None
+        self.last = None
+        self.latencies = []
+        self.error = None
+
+    def record(self, latency=None):
+        now = time.time()
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.count += 1
+        if latency is not None:
+            self.latencies.append(latency)
+
+class LoadGenerator(MultipleProducerConsumer):
+    '''
+        N producers and M consumers, each with its own connection, sending
+        to one destination on one broker or spread over a network of brokers
+    '''
+
+    def __init__(self, brokerName, brokerHost, otherBrokers=None, port=6163, destination='/queue/monitor.test.load', producers=1, consumers=1, messages=100, rate=0, size=1024, hostcert=None, hostkey=None, timeout=60):
+        MultipleProducerConsumer.__init__(self)
+
+        self.brokerName = brokerName
+        self.brokerHost = brokerHost
+        self.otherBrokers = otherBrokers or dict()
+        self.port = port
+        self.destination = destination
+        self.producers = producers
+        self.consumers = consumers
+        self.messages = messages
+        self.rate = rate
+        self.size = size
+        self.hostcert = hostcert
+        self.hostkey = hostkey
+        self.timeout = timeout
+
+        self.producerStats = []
+        self.consumerStats = []
+        self.elapsed = 0.0
+
+    def setup(self):
+
+        if self.hostcert and self.hostkey:
+            self.setSSLAuthentication(self.hostcert, self.hostkey)
+        ''' Consumers count through their handler, keep no body per message '''
+        self.setMessageFilter([LOAD_HEADER + '*'], body=False)
+        ''' Only this run's messages are consumed, the ones left behind expire '''
+        self.setRunId(timeout=self.timeout)
+        hosts = [self.brokerHost] + sorted(self.otherBrokers.values())
+        ''' One broker item, hence one connection, per producer and consumer '''
+        for i in range(self.producers):
+            self.createBroker('%s-producer-%d' % (self.brokerName, i), self.brokerHost, self.port)
+            self.producerStats.append(WorkerStats('%s-producer-%d' % (self.brokerName, i)))
+        for i in range(self.consumers):
+            self.createBroker('%s-consumer-%d' % (self.brokerName, i), hosts[i % len(hosts)], self.port)
+            self.consumerStats.append(WorkerStats('%s-consumer-%d' % (self.brokerName, i)))
+
+    def run(self):
+
+        timer = Timer(self.timeout)
+        body = PayloadPool([self.size]).body(self.size)
+
+        ''' Starting consumers '''
+        for stats in self.consumerStats:
+            self.createConsumer(stats.name, self.destination, timer.left,
+                                handler=self.consumed(stats))
+        if self.destination.startswith('/topic/'):
+            time.sleep(1)
+
+        ''' Connecting producers, then sending from one thread each '''
+        for stats in self.producerStats:
+            self.createProducer(stats.name, self.destination, timer.left)
+        threads = [threading.Thread(target=self.produce, args=(stats, body, timer))
+                   for stats in self.producerStats]
+        start = timer.time()
+        for t in threads:
+            t.setDaemon(True)
+            t.start()
+        for t in threads:
+            t.join(timer.left)
+
+        ''' Waiting for consumers to drain what was sent '''
+        expected = self.expected()
+        while self.received() < expected and timer.left > 0:
+            timer.sleep(0.1)
+        self.elapsed = timer.time() - start
+
+        for stats in self.producerStats:
+            if stats.error:
+                raise stats.error
+        if self.received() < expected:
+            raise TimeoutException('received %d of %d messages after %.2f seconds' % (self.received(), expected, self.elapsed))
+
+    def produce(self, stats, body, timer):
+        try:
+            for i in range(self.messages):
+                if timer.left <= 0:
+                    break
+                sent = time.time()
+                self.sendMessage(stats.name,
+                                 self.destination,
+                                 {'persistent':'false',
+                                  LOAD_PRODUCER_HEADER:stats.name,
+                                  LOAD_SENT_HEADER:'%f' % sent},
+                                 body,
+                                 timeout=timer.left)
+                stats.record()
+                if self.rate:
+                    delay = stats.first + (i + 1.0) / self.rate - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+        except Exception, e:
+            stats.error = e
+
+    def consumed(self, stats):
+        def handler(headers, body):
+            if headers.get(MONITOR_RUN_HEADER) != self.getRunId():
+                return
+            try:
+                stats.record(time.time() - float(headers[LOAD_SENT_HEADER]))
+            except (KeyError, ValueError):
+                stats.record()
+        return handler
+
+    def expected(self):
+        '''
+            Every consumer of a topic gets every message, queue consumers share them
+        '''
+        sent = sum([s.count for s in self.producerStats])
+        if self.destination.startswith('/topic/'):
+            return sent * self.consumers
+        return sent
+
+    def sent(self):
+        return sum([s.count for s in self.producerStats])
+
+    def received(self):
+        return sum([s.count for s in self.consumerStats])
+
+    def throughput(self, workers):
+        '''
+            Messages per second between the first and the last message
+        '''
+        firsts = [s.first for s in workers if s.first is not None]
+        lasts = [s.last for s in workers if s.last is not None]
+        if not firsts or max(lasts) <= min(firsts):
+            return 0.0
+        return sum([s.count for s in workers]) / (max(lasts) - min(firsts))
+
+    def getSummary(self):
+        latencies = []
+        for s in self.consumerStats:
+            latencies.extend(s.latencies)
+        return {'sent': self.sent(),
+                'received': self.received(),
+                'elapsed': self.elapsed,
+                'send_rate': self.throughput(self.producerStats),
+                'receive_rate': self.throughput(self.consumerStats),
+                'latency': summary(latencies)}
+
+if __name__ == '__main__':
+
+    log.setLevel(logging.INFO)
+    logging.getLogger('MultipleProducerConsumer').setLevel(logging.INFO)
+    broker = 'vtb26'
+    brokerHost = 'vtb-generic-26.cern.ch'
+
+    lg = LoadGenerator(broker, brokerHost, producers=4, consumers=4, messages=1000)
+    lg.setup()
+    try:
+        lg.start()
+    except KeyboardInterrupt:
+        print "keyboard interrupt"
+    except TimeoutException, e:
+        print '%s' % e
+    lg.stop()
+
+    print lg.getSummary()
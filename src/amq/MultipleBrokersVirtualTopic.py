@@ -7,15 +7,18 @@ import os
 from MultipleProducerConsumer import MultipleProducerConsumer, TimeoutException
 import sys
 import time
-from utils.Timer import Timer
 
 import logging
 logging.basicConfig()
 log = logging.getLogger(__file__)
 
+''' Share of the timeout kept for each phase while the earlier ones run '''
+PHASES = [('connect', 0.0), ('send', 0.1), ('receive', 0.15), ('duplicates', 0.1)]
+PAYLOAD_PHASES = [('connect', 0.0), ('payload', 0.25)]
+
 class MultipleBrokersVirtualTopic(MultipleProducerConsumer):
     
-    def __init__(self, mainBrokerName, mainBrokerHost, otherBrokers, port=6163, destination='test.virtualtopic', vtPrefix='Consumer', hostcert=None, hostkey=None, messages=10, timeout=15):
+    def __init__(self, mainBrokerName, mainBrokerHost, otherBrokers, port=6163, destination='test.virtualtopic', vtPrefix='Consumer', hostcert=None, hostkey=None, messages=10, timeout=15, payloadSizes=None, drain=False):
         MultipleProducerConsumer.__init__(self)
         
         self.mainBrokerName = mainBrokerName
@@ -28,49 +31,79 @@ class MultipleBrokersVirtualTopic(MultipleProducerConsumer):
         self.hostkey = hostkey
         self.messages = messages
         self.timeout = timeout
+        self.payloadSizes = payloadSizes
+        self.payloadResults = []
+        self.drain = drain
         
     def setup(self):
         self.destinationTopic = '/topic/%s' % self.destination
         
         if self.hostcert and self.hostkey:
             self.setSSLAuthentication(self.hostcert, self.hostkey)
+        ''' Only counted and checksummed, keep no body per message '''
+        self.setMessageFilter(['message-id', 'monitor.*'], digest=True)
+        ''' Only this run's messages are delivered, leftovers are not counted '''
+        self.setRunId(timeout=self.timeout)
         self.createBroker(self.mainBrokerName, self.mainBrokerHost, self.port)
         for name, host in self.otherBrokers.items():
             self.createBroker(name, host, self.port)
         
     def run(self):
         
-        timer = Timer(self.timeout)
+        timer = self.createScheduler(self.timeout, self.payloadSizes and PAYLOAD_PHASES or PHASES)
         
         ''' Starting consumers '''
+        timer.begin('connect')
+        if self.drain:
+            for name, host in self.otherBrokers.items():
+                self.drainConsumer(name,
+                                   '/queue/%s.%s.%s' % (self.vtPrefix, name, self.destination),
+                                   timer.phaseLeft / (2 * len(self.otherBrokers)))
         for name, host in self.otherBrokers.items():
             self.createConsumer(name, 
                                 '/queue/%s.%s.%s' % (self.vtPrefix, name, self.destination), 
-                                timer.left)
-        time.sleep(1)
+                                timer.phaseLeft)
+        timer.sleep(1)
         
         ''' Creating producer and sending messages '''
-        self.createProducer(self.mainBrokerName, self.destinationTopic, timer.left)
+        self.createProducer(self.mainBrokerName, self.destinationTopic, timer.phaseLeft)
+        if self.payloadSizes:
+            timer.begin('payload')
+            consumers = [(broker, '/queue/%s.%s.%s' % (self.vtPrefix, broker, self.destination)) for broker in self.otherBrokers]
+            self.payloadResults = self.sweepPayloads(self.mainBrokerName,
+                                                     self.destinationTopic,
+                                                     consumers,
+                                                     self.payloadSizes,
+                                                     self.messages,
+                                                     timer)
+            for broker in self.otherBrokers:
+                self.completed(broker)
+            return
+        timer.begin('send')
         for i in range(self.messages):
             self.sendMessage(self.mainBrokerName, 
                              self.destinationTopic, 
-                             {'persistent':'true'}, 
-                             'testing-%s' % i)
+                             {'persistent':'true',
+                              'receipt':self.receiptId()}, 
+                             'testing-%s' % i,
+                             timeout=timer.phaseLeft)
         self.waitForMessagesToBeSent(self.mainBrokerName,
                                      self.destinationTopic,
-                                     self.messages)
+                                     timer.phaseLeft)
         
+        timer.begin('receive')
         for broker in self.otherBrokers:
-            self.waitForMessagesToArrive(broker, '/queue/%s.%s.%s' % (self.vtPrefix, broker, self.destination), self.messages, timer.left)
+            self.waitForMessagesToArrive(broker, '/queue/%s.%s.%s' % (self.vtPrefix, broker, self.destination), self.messages, timer.phaseLeft)
+            self.completed(broker)
 
-        ''' Wait a couple of seconds to see if we get duplicated '''
-        time.sleep(2)
+        ''' Wait a couple of seconds to see if we get duplicated, the first duplicate decides the run '''
+        timer.begin('duplicates')
+        self.waitForDuplicates([(broker, '/queue/%s.%s.%s' % (self.vtPrefix, broker, self.destination)) for broker in self.otherBrokers],
+                               self.messages,
+                               min(2, timer.phaseLeft))
         
         for broker in self.otherBrokers:
             self.assertMessagesNumber(broker, '/queue/%s.%s.%s' % (self.vtPrefix, broker, self.destination), self.messages)
-            
-    def stop(self):
-        self.destroyAllBrokers()
 
 if __name__ == '__main__':
 
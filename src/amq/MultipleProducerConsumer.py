@@ -3,16 +3,29 @@
 
 import os
 import socket
-import stomp
-import subprocess
+import sys
 import time
 from collections import deque
 from threading import Timer
+from utils.Admission import AdmissionScheduler
+from utils.Payload import PayloadPool, PayloadResult, checksum, formatSize
+from utils.PhaseScheduler import PhaseScheduler
+from utils.Resources import ResourceMonitor
+from utils.SSLContextCache import withSSLContextCache
 
 import logging
 logging.basicConfig()
 log = logging.getLogger('MultipleProducerConsumer')
 
+''' Run id property, selectors only accept identifiers so no dots '''
+MONITOR_RUN_HEADER = 'monitor_run'
+DRAIN_PREFETCH = 1000
+''' Probes of a run expire after its timeout, at least after this many seconds as the broker clock may differ '''
+RUN_EXPIRY_MIN = 60
+''' Delays between reconnection attempts, doubling from min to max seconds '''
+RECONNECT_BACKOFF_MIN = 0.1
+RECONNECT_BACKOFF_MAX = 2.0
+
 class TimeoutException(Exception):
     def __init__(self, cause):
         self._cause = cause
@@ -20,6 +33,13 @@ class TimeoutException(Exception):
     def __str__(self):
         return '<Timeout exception: %s>' % self._cause
     
+class FlowControlException(TimeoutException):
+    '''
+        The broker is reachable but is holding back producers
+    '''
+    def __str__(self):
+        return '<Flow control exception: %s>' % self._cause
+    
 class ErrorFrameException(Exception):
     def __init__(self, cause):
         self._cause = cause
@@ -28,9 +48,10 @@ class ErrorFrameException(Exception):
         return '<Error frame exception: %s>' % self._cause
     
 class Message(object):
-    def __init__(self, headers, body):
+    def __init__(self, headers, body, timestamp=None):
         self._headers = headers
         self._body = body
+        self._timestamp = timestamp or time.time()
     
     def headers(self):
         return self._headers
@@ -44,8 +65,94 @@ class Message(object):
     def setBody(self, body):
         self._body = body
         
+    def timestamp(self):
+        '''
+            local time the frame was sent or received
+        '''
+        return self._timestamp
+    
+    def length(self):
+        return len(self._body)
+    
+    def digest(self):
+        '''
+            CRC32 of the body
+        '''
+        return checksum(self._body)
+        
+    headers = property(headers)
+    body = property(body)
+    timestamp = property(timestamp)
+    length = property(length)
+    digest = property(digest)
+    
+class CompactMessage(object):
+    '''
+        Message keeping only the headers a check asked for, as a tuple
+        of pairs, and optionally the body length and CRC32 instead of
+        the body
+    '''
+    __slots__ = ('_headers', '_body', '_length', '_digest', '_timestamp')
+    
+    def __init__(self, headers, body, length, digest=None, timestamp=None):
+        self._headers = headers
+        self._body = body
+        self._length = length
+        self._digest = digest
+        self._timestamp = timestamp or time.time()
+    
+    def headers(self):
+        return dict(self._headers)
+    
+    def body(self):
+        '''
+            None if only the digest was kept
+        '''
+        return self._body
+    
+    def timestamp(self):
+        return self._timestamp
+    
+    def length(self):
+        return self._length
+    
+    def digest(self):
+        if self._digest is None:
+            return checksum(self._body)
+        return self._digest
+    
     headers = property(headers)
     body = property(body)
+    timestamp = property(timestamp)
+    length = property(length)
+    digest = property(digest)
+    
+class MessageFilter(object):
+    '''
+        Build a CompactMessage from a frame. headers lists the header
+        names to keep, a trailing * keeps every header with that prefix,
+        None keeps them all. With digest the body is dropped and only
+        its length and CRC32 are kept, without body only its length.
+    '''
+    
+    def __init__(self, headers=None, digest=False, body=True):
+        self._all = headers is None
+        self._names = set([h for h in headers or [] if not h.endswith('*')])
+        self._prefixes = tuple([h[:-1] for h in headers or [] if h.endswith('*')])
+        self._digest = digest
+        self._body = body
+        
+    def keep(self, name):
+        return self._all or name in self._names or \
+            (self._prefixes and name.startswith(self._prefixes))
+    
+    def __call__(self, headers, body):
+        kept = tuple([(k, v) for k, v in headers.items() if self.keep(k)])
+        if not self._body:
+            return CompactMessage(kept, None, len(body))
+        if self._digest:
+            return CompactMessage(kept, None, len(body), checksum(body))
+        return CompactMessage(kept, body, len(body))
     
 class RingBuffer(deque):
     def __init__(self, size):
@@ -63,25 +170,176 @@ class RingBuffer(deque):
         if len(self) == self.size:
             self.append = self.full_append
     
+    def clear(self):
+        deque.clear(self)
+        # back to plain appends until the buffer fills up again
+        self.__dict__.pop('append', None)
+    
     def get(self):
         """returns a list of size items (newest items)"""
         return list(self)
 
+class SendStats(object):
+    '''
+        Time spent blocked in send calls and waiting for receipts,
+        a send or receipt slower than threshold counts as stalled
+    '''
+    
+    def __init__(self, threshold=1.0):
+        self.threshold = threshold
+        self.sends = 0
+        self.sendMax = 0.0
+        self.sendTotal = 0.0
+        self.receipts = 0
+        self.receiptMax = 0.0
+        self.stalled = 0
+        
+    def addSend(self, elapsed):
+        self.sends += 1
+        self.sendTotal += elapsed
+        self.sendMax = max(self.sendMax, elapsed)
+        if elapsed > self.threshold:
+            self.stalled += 1
+        
+    def addReceipt(self, elapsed):
+        self.receipts += 1
+        self.receiptMax = max(self.receiptMax, elapsed)
+        if elapsed > self.threshold:
+            self.stalled += 1
+            
+    def merge(self, other):
+        self.sends += other.sends
+        self.sendTotal += other.sendTotal
+        self.sendMax = max(self.sendMax, other.sendMax)
+        self.receipts += other.receipts
+        self.receiptMax = max(self.receiptMax, other.receiptMax)
+        self.stalled += other.stalled
+        
+    def perfdata(self):
+        '''
+            Return (label, value, uom) tuples
+        '''
+        return [('send_time_max', self.sendMax, 's'),
+                ('receipt_time_max', self.receiptMax, 's'),
+                ('stalled_sends', self.stalled, '')]
+        
+class ConnectStats(object):
+    '''
+        Time connection attempts spent waiting for admission on this
+        host, apart from the time the broker took to accept them
+    '''
+    
+    def __init__(self):
+        self.connections = 0
+        self.queued = 0.0
+        self.queuedMax = 0.0
+        self.connectMax = 0.0
+        
+    def add(self, queued, connect):
+        self.connections += 1
+        self.queued += queued
+        self.queuedMax = max(self.queuedMax, queued)
+        self.connectMax = max(self.connectMax, connect)
+        
+    def merge(self, other):
+        self.connections += other.connections
+        self.queued += other.queued
+        self.queuedMax = max(self.queuedMax, other.queuedMax)
+        self.connectMax = max(self.connectMax, other.connectMax)
+        
+    def perfdata(self):
+        '''
+            Return (label, value, uom) tuples
+        '''
+        return [('admission_wait', self.queued, 's'),
+                ('admission_wait_max', self.queuedMax, 's'),
+                ('connect_time_max', self.connectMax, 's')]
+        
+class FailoverStats(object):
+    '''
+        Connections lost during the run and the time taken to get them
+        back, sends whose receipt was lost with the connection are
+        counted as unconfirmed
+    '''
+    
+    def __init__(self):
+        self.disconnects = 0
+        self.recovered = 0
+        self.recoveryMax = 0.0
+        self.unconfirmed = 0
+        
+    def addRecovery(self, elapsed):
+        self.recovered += 1
+        self.recoveryMax = max(self.recoveryMax, elapsed)
+        
+    def merge(self, other):
+        self.disconnects += other.disconnects
+        self.recovered += other.recovered
+        self.recoveryMax = max(self.recoveryMax, other.recoveryMax)
+        self.unconfirmed += other.unconfirmed
+        
+    def perfdata(self):
+        '''
+            Return (label, value, uom) tuples
+        '''
+        return [('disconnects', self.disconnects, ''),
+                ('recovery_time_max', self.recoveryMax, 's'),
+                ('unconfirmed_sends', self.unconfirmed, '')]
+        
 class Listener(object):
     
-    def __init__(self, buffer_size=100):
+    def __init__(self, buffer_size=100, send_stats=None, message_filter=None):
         self._is_connected = False
         self._sent = RingBuffer(buffer_size)
         self._received = RingBuffer(buffer_size)
         self._errors = RingBuffer(buffer_size)
         self._waiting_receipt = dict()
+        self._receipt_sent = dict()
+        self._unmeasured = set()
+        self._send_stats = send_stats
+        self._message_handler = None
+        self._message_filter = message_filter or Message
+        self._disconnected = None
         
     def getMessages(self):
         return self._received.get()
     
+    def clearMessages(self):
+        self._received.clear()
+    
+    def setMessageHandler(self, handler):
+        '''
+            handler(headers, body) is called from the receiver thread
+            for every message
+        '''
+        self._message_handler = handler
+    
     def getWaitingForReceipt(self):
         return self._waiting_receipt
     
+    def unmeasured(self, receipt):
+        '''
+            Keep the receipt of the next send out of the send stats
+        '''
+        self._unmeasured.add(receipt)
+    
+    def forgetReceipts(self):
+        '''
+            Drop the receipts a lost connection will never deliver,
+            return how many were waiting
+        '''
+        waiting = len(self._waiting_receipt)
+        self._waiting_receipt.clear()
+        self._receipt_sent.clear()
+        self._unmeasured.clear()
+        return waiting
+    
+    def isLost(self):
+        '''
+            Connected once, then dropped
+        '''
+        return not self._is_connected and self._disconnected is not None
+    
     def getErrors(self):
         return self._errors.get()
     
@@ -96,19 +354,24 @@ class Listener(object):
         self.__print_async("CONNECTED", headers, body)
     
     def on_disconnected(self, headers, body):
+        if self._is_connected:
+            self._disconnected = time.time()
         self._is_connected = False
         self.__print_async("LOST CONNECTION", headers, body)
 
     def on_send(self, headers, body):
         if 'receipt' in headers:
-            self._waiting_receipt[headers['receipt']] = Message(headers, body)
+            self._waiting_receipt[headers['receipt']] = self._message_filter(headers, body)
+            self._receipt_sent[headers['receipt']] = time.time()
         else:
-            self._sent.append(Message(headers, body))
+            self._sent.append(self._message_filter(headers, body))
         self.__print_async("SENT", headers, body)
 
     def on_message(self, headers, body):
-        self._received.append(Message(headers, body))
+        self._received.append(self._message_filter(headers, body))
         self.__print_async("MESSAGE", headers, body)
+        if self._message_handler:
+            self._message_handler(headers, body)
 
     def on_error(self, headers, body):
         self._errors.append(Message(headers, body))
@@ -119,9 +382,17 @@ class Listener(object):
         if headers.get('receipt-id', '') in self._waiting_receipt:
             self._sent.append(self._waiting_receipt[headers['receipt-id']])
             del self._waiting_receipt[headers['receipt-id']]
+        sent = self._receipt_sent.pop(headers.get('receipt-id', ''), None)
+        if headers.get('receipt-id', '') in self._unmeasured:
+            self._unmeasured.discard(headers['receipt-id'])
+        elif sent is not None and self._send_stats:
+            self._send_stats.addReceipt(time.time() - sent)
         self.__print_async("RECEIPT", headers, body)
 
     def __print_async(self, frame_type, headers, body):
+        # called for every frame, skip building the strings unless needed
+        if not log.isEnabledFor(logging.DEBUG):
+            return
         log.debug('Received : %s' % frame_type)
         
         if headers:
@@ -136,14 +407,23 @@ def connectionTimeout(connection):
             
 class BrokerItem:
     
-    def __init__(self, name, host, port, connection_extra_headers=None):
+    def __init__(self, name, host, port, connection_extra_headers=None, buffer_size=100, message_filter=None, admission=None):
         self._name = name
         self._host = host
         self._port = port
         self._connection_extra_headers = connection_extra_headers
+        self._buffer_size = buffer_size
+        self._message_filter = message_filter
+        self._admission = admission
         self._consumers = list()
         self._producers = list()
         self._connections = dict()
+        self._send_stats = SendStats()
+        self._connect_stats = ConnectStats()
+        self._failover_stats = FailoverStats()
+        self._failover = True
+        self._subscriptions = dict()
+        self._unconfirmed = dict()
 
     def name(self):
         return self._name
@@ -163,34 +443,117 @@ class BrokerItem:
         '''
         self._connection_extra_headers = connection_extra_headers
         
-    def createConnection(self, destination, timeout):
+    def setConnectionHeader(self, key, value):
+        '''
+            Add one header used at connection time
+        '''
+        self._connection_extra_headers[key] = value
+        
+    def createConnection(self, destination, timeout, listener=None):
+        import stomp
         self._connections[destination] = stomp.Connection([(self._host, self._port)], **self._connection_extra_headers)
-        self._connections[destination].set_listener('%s' % destination, Listener())
+        if listener is None:
+            listener = Listener(self._buffer_size, send_stats=self._send_stats, message_filter=self._message_filter)
+        self._connections[destination].set_listener('%s' % destination, listener)
         # stomppy doesn't support connection timeout, resolving it with a timer
         stopper = Timer(timeout, connectionTimeout, [self._connections[destination]])
         stopper.start()
-        self._connections[destination].start()
+        if self._connection_extra_headers.get('use_ssl'):
+            # the socket is wrapped while starting, with one SSL context per process
+            withSSLContextCache(sys.modules[stomp.Connection.__module__], self._connections[destination].start)
+        else:
+            self._connections[destination].start()
         stopper.cancel()
         if self._connections[destination].is_connected():
             self._connections[destination].connect()
         else:
+            self.destroyConnection(destination)
+            del self._connections[destination]
             raise TimeoutException('Timeout during connection')
     
+    def getSendStats(self):
+        return self._send_stats
+    
+    def setFlowControlThreshold(self, threshold):
+        self._send_stats.threshold = threshold
+    
+    def getFailoverStats(self):
+        return self._failover_stats
+    
+    def setFailover(self, enabled):
+        self._failover = enabled
+        
+    def isLost(self, destination):
+        listener = self.getListener(destination)
+        return self._failover and listener is not None and listener.isLost()
+    
+    def recover(self, destination, timeout):
+        '''
+            Reconnect a dropped connection keeping its listener, so what
+            was received so far still counts, and subscribe again with
+            the same headers. Attempts back off within timeout, raise
+            TimeoutException if the connection could not be recovered.
+        '''
+        listener = self.getListener(destination)
+        start = time.time()
+        deadline = start + timeout
+        self._failover_stats.disconnects += 1
+        unconfirmed = listener.forgetReceipts()
+        self._failover_stats.unconfirmed += unconfirmed
+        self._unconfirmed[destination] = self._unconfirmed.get(destination, 0) + unconfirmed
+        log.info('Connection to broker %s lost on %s, reconnecting' % (self._host, destination))
+        delay = RECONNECT_BACKOFF_MIN
+        while True:
+            self.destroyConnection(destination)
+            try:
+                self.createConnection(destination, max(0.1, deadline - time.time()), listener)
+                self.waitForConnection(destination, max(0.1, deadline - time.time()))
+                if destination in self._subscriptions:
+                    self._connections[destination].subscribe(destination=destination, ack='auto', **self._subscriptions[destination])
+                self._failover_stats.addRecovery(time.time() - start)
+                log.info('Connection to broker %s on %s recovered after %.2f seconds' % (self._host, destination, time.time() - start))
+                return
+            except TimeoutException, e:
+                log.info('Reconnecting to broker %s failed: %s' % (self._host, e))
+            if time.time() + delay >= deadline:
+                raise TimeoutException('connection to broker %s lost on %s and not recovered after %.2f seconds' % (self._host, destination, time.time() - start))
+            time.sleep(delay)
+            delay = min(delay * 2, RECONNECT_BACKOFF_MAX)
+    
     def getConnection(self, destination):
         '''
         '''
         return self._connections.get(destination, None)
     
     def ensureConnection(self, destination, timeout):
-        if destination not in self._connections:
+        if destination in self._connections:
+            if self.isLost(destination):
+                self.recover(destination, timeout)
+            self.waitForConnection(destination, timeout)
+            return
+        start = time.time()
+        slot = None
+        if self._admission:
+            slot = self._admission.acquire(self._host, self._port, timeout)
+        admitted = time.time()
+        try:
+            # the time queued for admission comes out of the budget
+            timeout = max(0.1, timeout - (admitted - start))
             self.createConnection(destination, timeout)
-        self.waitForConnection(destination, timeout)
+            self.waitForConnection(destination, timeout)
+        finally:
+            if self._admission:
+                self._admission.release(slot)
+            self._connect_stats.add(admitted - start, time.time() - admitted)
+            
+    def getConnectStats(self):
+        return self._connect_stats
             
     def closeConnection(self, destination):
         if ((destination in self._connections) and
             (destination not in self._consumers) and
             (destination not in self._producers)):
-            self._connections[destination].stop()
+            self.destroyConnection(destination)
             del self._connections[destination]
         
     def getListener(self, destination):
@@ -198,9 +561,13 @@ class BrokerItem:
             return None
         return self._connections[destination].get_listener(destination)
         
-    def createConsumer(self, destination, timeout=5):
+    def createConsumer(self, destination, timeout=5, headers=None, handler=None):
         self.ensureConnection(destination, timeout)
-        self._connections[destination].subscribe(destination=destination, ack='auto')
+        if handler:
+            # set before subscribing, no message goes unhandled
+            self.getListener(destination).setMessageHandler(handler)
+        self._connections[destination].subscribe(destination=destination, ack='auto', **(headers or {}))
+        self._subscriptions[destination] = dict(headers or {})
         if destination not in self._consumers:
             self._consumers.append(destination)
         
@@ -209,6 +576,31 @@ class BrokerItem:
         if destination not in self._producers:
             self._producers.append(destination)
             
+    def drainConsumer(self, destination, timeout=5, quiet=0.5, selector=None):
+        '''
+            Consume what is left on destination by earlier runs with a
+            large prefetch, until no message arrived for quiet seconds,
+            only the messages matching selector if given
+        '''
+        self.ensureConnection(destination, timeout)
+        connection = self._connections[destination]
+        listener = self.getListener(destination)
+        deadline = time.time() + timeout
+        headers = {'activemq.prefetchSize': DRAIN_PREFETCH}
+        if selector:
+            headers['selector'] = selector
+        connection.subscribe(destination=destination, ack='auto', **headers)
+        last = time.time()
+        while time.time() < deadline:
+            messages = listener.getMessages()
+            if messages:
+                last = max(last, messages[-1].timestamp)
+            if time.time() - last >= quiet:
+                break
+            time.sleep(0.05)
+        connection.unsubscribe(destination=destination)
+        listener.clearMessages()
+            
     def waitForConnection(self, destination, timeout=5):
         '''
             Wait for established connection
@@ -226,6 +618,14 @@ class BrokerItem:
             return self.getConnection(destination).get_listener(destination).getMessages()
         return []
     
+    def clearMessages(self, destination):
+        if self.getConnection(destination):
+            self.getConnection(destination).get_listener(destination).clearMessages()
+    
+    def setMessageHandler(self, destination, handler):
+        if self.getConnection(destination):
+            self.getConnection(destination).get_listener(destination).setMessageHandler(handler)
+    
     def getErrors(self, destination):
         if self.getConnection(destination):
             return self.getConnection(destination).get_listener(destination).getErrors()
@@ -244,6 +644,11 @@ class BrokerItem:
         elapsed = 0
         while (len(self.getMessages(destination)) < number) \
                 and (elapsed < timeout):
+            if self.isLost(destination):
+                start = time.time()
+                self.recover(destination, timeout - elapsed)
+                elapsed += time.time() - start
+                continue
             elapsed += 0.1
             time.sleep(0.1)
         if len(self.getMessages(destination)) < number:
@@ -255,28 +660,71 @@ class BrokerItem:
             and destination to be sent with timeout
         '''
         elapsed = 0
+        self.assertConfirmed(destination)
         while (len(self.getWaitingForReceipt(destination)) > 0) \
                 and (elapsed < timeout):
+            if self.isLost(destination):
+                # the receipts are gone with the connection
+                start = time.time()
+                self.recover(destination, timeout - elapsed)
+                elapsed += time.time() - start
+                self.assertConfirmed(destination)
+                continue
             elapsed += 0.1
             time.sleep(0.1)
         if len(self.getWaitingForReceipt(destination)) > 0:
+            # missing receipts alone may as well be a hung broker, flow
+            # control also shows as sends blocking or receipts coming late
+            if self.getListener(destination).isConnected() and self._send_stats.stalled:
+                raise FlowControlException('broker %s is blocking producers on destination %s, %d messages without receipt after %.2f seconds, %d sends or receipts slower than %.1f seconds' % (self._host, destination, len(self.getWaitingForReceipt(destination)), elapsed, self._send_stats.stalled, self._send_stats.threshold))
             raise TimeoutException('timeout waiting for messages to be sent for broker %s and destination %s, waited for %.2f seconds' % (self._host, destination,elapsed))
         
-    def sendMessage(self, destination, headers, body):
-        if destination not in self._producers:
-            self.createProducer(destination)
-        self.getConnection(destination).send(body,
+    def assertConfirmed(self, destination):
+        '''
+            Raise TimeoutException if sends on destination lost their
+            receipt with a failed over connection. Whether the broker got
+            them is unknown, resending could deliver them twice.
+        '''
+        unconfirmed = self._unconfirmed.pop(destination, 0)
+        if unconfirmed:
+            stats = self._failover_stats
+            raise TimeoutException('connection to broker %s on %s failed over, %d messages sent without receipt, %d disconnects, recovered in %.2f seconds at most' % (self._host, destination, unconfirmed, stats.disconnects, stats.recoveryMax))
+        
+    def sendMessage(self, destination, headers, body, via=None, timeout=5, measured=True):
+        '''
+            Send a message, via names the destination whose connection
+            is used instead, e.g. the consumer of a temporary reply queue.
+            Connecting or recovering it takes at most timeout. Sends not
+            measured, e.g. large payloads, stay out of the send stats.
+        '''
+        if via is None:
+            via = destination
+        if via not in self._producers and via not in self._consumers:
+            self.createProducer(via, timeout)
+        elif self.isLost(via):
+            self.recover(via, timeout)
+        if not measured and 'receipt' in headers:
+            self.getListener(via).unmeasured(headers['receipt'])
+        # a send blocking on the socket is the first sign of flow control
+        start = time.time()
+        self.getConnection(via).send(body,
                                              destination=destination, 
                                              headers=headers)
+        if measured:
+            self._send_stats.addSend(time.time() - start)
     
     def deleteConsumer(self, destination):
         if destination in self._consumers:
-            self._connections[destination].unsubscribe(destination=destination, ack='auto')
+            connection = self.getConnection(destination)
+            # nothing to unsubscribe from on a lost connection
+            if connection is not None and connection.is_connected():
+                connection.unsubscribe(destination=destination, ack='auto')
             self._consumers.remove(destination)
+            self._subscriptions.pop(destination, None)
             self.closeConnection(destination)
         
     def deleteAllConsumers(self):
-        for c in self._consumers:
+        for c in list(self._consumers):
             self.deleteConsumer(c)
         
     def deleteProducer(self, destination):
@@ -285,16 +733,25 @@ class BrokerItem:
             self.closeConnection(destination)
         
     def deleteAllProducers(self):
-        for p in self._producers:
+        for p in list(self._producers):
             self.deleteProducer(p)
             
     def destroyConnection(self, connection):
-        if self._connections[connection] and self._connections[connection].is_connected():
-            self._connections[connection].stop()
+        conn = self._connections.get(connection, None)
+        if conn is None:
+            return
+        if conn.is_connected():
+            try:
+                conn.stop()
+            except Exception, e:
+                log.debug('Error stopping connection for %s: %s' % (connection, e))
+        # make sure the receiver loop exits even if the connection was never established
+        connectionTimeout(conn)
             
     def destroyAllConnections(self):
         for t in self._connections:
             self.destroyConnection(t)
+        self._connections.clear()
             
     def destroy(self):
         self.deleteAllConsumers()
@@ -309,6 +766,99 @@ class MultipleProducerConsumer:
         self._consumers = dict()
         self._producers = dict()
         self._brokers = dict()
+        self._buffer_size = 100
+        self._resources = None
+        self._profiler = None
+        self._receipt_counter = 0
+        self._flow_control_threshold = 1.0
+        self._scheduler = None
+        self._completed = []
+        self._message_filter = None
+        self._run_id = None
+        self._run_expiry = RUN_EXPIRY_MIN
+        self._admission = None
+        self._failover = True
+        
+    def setRunId(self, run_id=None, timeout=None):
+        '''
+            Tag every message sent with a run id and subscribe with a
+            selector on it, so the broker only delivers this run's
+            messages, a random id is used if none is given. The messages
+            expire after timeout, RUN_EXPIRY_MIN at least, so the ones
+            no run consumes do not pile up in front of the selector.
+        '''
+        self._run_id = run_id or os.urandom(16).encode('hex')
+        self._run_expiry = max(RUN_EXPIRY_MIN, timeout or 0)
+        
+    def getRunId(self):
+        return self._run_id
+    
+    def runSelector(self):
+        return "%s = '%s'" % (MONITOR_RUN_HEADER, self._run_id)
+    
+    def staleSelector(self):
+        '''
+            Messages of no run or older than a run may last, leaving
+            alone the ones of the runs of other hosts still going on
+        '''
+        return '%s IS NULL OR JMSTimestamp < %d' % (MONITOR_RUN_HEADER, (time.time() - self._run_expiry) * 1000)
+        
+    def createScheduler(self, timeout, reserves=None):
+        '''
+            Create the utils.PhaseScheduler splitting timeout between the
+            phases of the run, reserves is a list of (phase, share of
+            timeout kept for the phase)
+        '''
+        self._scheduler = PhaseScheduler(timeout, reserves)
+        self._completed = []
+        return self._scheduler
+    
+    def completed(self, item):
+        '''
+            Record a broker or destination whose result is known
+        '''
+        self._completed.append(item)
+    
+    def getPartialResults(self):
+        '''
+            Phases and brokers that finished before the run was interrupted
+        '''
+        if not self._scheduler:
+            return ''
+        report = self._scheduler.report()
+        if self._completed:
+            report += '; completed: %s' % ', '.join(self._completed)
+        return report
+        
+    def setProfiler(self, profiler):
+        '''
+            Profile the run and stop phases with the given utils.Profiler
+        '''
+        self._profiler = profiler
+        
+    def enableResourceMonitor(self):
+        '''
+            Snapshot threads, fds, RSS and CPU time around each check phase
+        '''
+        self._resources = ResourceMonitor()
+        
+    def getResourceMonitor(self):
+        return self._resources
+    
+    def snapshotResources(self, phase):
+        '''
+            Take a resource snapshot if the monitor is enabled
+        '''
+        if self._resources:
+            log.debug('%s' % self._resources.snapshot(phase))
+    
+    def getLeaks(self):
+        '''
+            Return (threads, sockets) left behind after stop
+        '''
+        if self._resources:
+            return self._resources.leaks('start', 'stop')
+        return [], 0
         
     def setSSLAuthentication(self, hostcert, hostkey):
         '''
@@ -321,6 +871,29 @@ class MultipleProducerConsumer:
         self._connection_extra_headers['ssl_cert_file'] = '%s' % hostcert
         self._connection_extra_headers['ssl_key_file'] = '%s' % hostkey
         
+    def setBufferSize(self, buffer_size):
+        '''
+            Number of frames kept per destination by brokers created afterwards
+        '''
+        self._buffer_size = buffer_size
+        
+    def setMessageFilter(self, headers=None, digest=False, body=True):
+        '''
+            Keep only these headers of the frames of brokers created
+            afterwards, and only the body length and CRC32 if digest
+            is set, or its length without body, see MessageFilter
+        '''
+        self._message_filter = MessageFilter(headers, digest, body)
+        
+    def setAdmission(self, slots, jitter=1.0, directory='/var/tmp/nagios-plugins-activemq'):
+        '''
+            Cap the concurrent connection attempts of this host to a
+            broker to slots, spread by up to jitter seconds when all are
+            taken, for brokers created afterwards, see
+            utils.AdmissionScheduler
+        '''
+        self._admission = AdmissionScheduler(directory, slots, jitter)
+        
     def setConnectionExtraHeaders(self, key, value):
         '''
             Add an extra header to the connection headers for all brokers
@@ -340,25 +913,44 @@ class MultipleProducerConsumer:
             Create Broker item
         '''
 #        log.info('Creating broker session: (%s, %s, %d)' % (brokerName, host, port))
-        self._brokers[brokerName] = BrokerItem(brokerName, host, port, dict(self._connection_extra_headers, **extra_headers))
+        self._brokers[brokerName] = BrokerItem(brokerName, host, port, dict(self._connection_extra_headers, **extra_headers), self._buffer_size, self._message_filter, self._admission)
+        self._brokers[brokerName].setFlowControlThreshold(self._flow_control_threshold)
+        self._brokers[brokerName].setFailover(self._failover)
         
-    def createConsumer(self, brokerName, destination, timeout=5):
+    def createConsumer(self, brokerName, destination, timeout=5, headers=None, handler=None):
         '''
-            Create and return a consumer for specified broker
+            Create and return a consumer for specified broker,
+            headers are added to the subscription and handler, see
+            setMessageHandler, is set before subscribing
         '''
         if brokerName in self._brokers:
             log.info('Creating consumer for %s on %s' % (brokerName, destination))
-            return self._brokers[brokerName].createConsumer(destination, timeout)
+            if self._run_id:
+                headers = dict({'selector': self.runSelector()}, **(headers or {}))
+            return self._brokers[brokerName].createConsumer(destination, timeout, headers, handler)
         log.info('No broker with name %s' % brokerName)
         return None
     
+    def drainConsumer(self, brokerName, destination, timeout=5, quiet=0.5):
+        '''
+            Remove the messages left on a queue by earlier runs without
+            expiry, a selector would leave them there for good
+        '''
+        if destination.startswith('/topic/'):
+            return
+        if brokerName in self._brokers:
+            log.info('Draining %s on %s' % (destination, brokerName))
+            self._brokers[brokerName].drainConsumer(destination, timeout, quiet, self.staleSelector())
+            return
+        log.info('No broker with name %s' % brokerName)
+    
     def createProducer(self, brokerName, destination, timeout=5):
         '''
             Create and return a producer for specified broker
         '''
         if brokerName in self._brokers:
             log.info('Creating producer for %s on %s' % (brokerName, destination))
-            return self._brokers[brokerName].createProducer(destination, timeout=5)
+            return self._brokers[brokerName].createProducer(destination, timeout)
         log.info('No broker with name %s' % brokerName)
         return None
     
@@ -379,6 +971,24 @@ class MultipleProducerConsumer:
             log.info('Waiting for %d messages from %s on broker %s' % (number, destination, brokerName))
             return self._brokers[brokerName].waitForMessagesToArrive(destination, number, timeout)
         
+    def waitForDuplicates(self, consumers, number, timeout=2):
+        '''
+            Wait up to timeout for more than number messages on any of
+            the (broker, destination) consumers. Return the first broker
+            receiving duplicates, the run is decided then, None otherwise.
+        '''
+        deadline = time.time() + timeout
+        while True:
+            for brokerName, destination in consumers:
+                if brokerName in self._brokers and \
+                        len(self._brokers[brokerName].getMessages(destination)) > number:
+                    if self._scheduler:
+                        self._scheduler.decide('duplicates from %s' % brokerName)
+                    return brokerName
+            if time.time() >= deadline:
+                return None
+            time.sleep(0.1)
+        
     def waitForMessagesToBeSent(self, brokerName, destination, timeout=5):
         '''
             Wait for all messages for given broker
@@ -398,6 +1008,21 @@ class MultipleProducerConsumer:
         log.info('No broker with name %s' % brokerName)
         return []
     
+    def clearMessages(self, brokerName, destination):
+        '''
+            Forget the messages received so far for selected broker and destination
+        '''
+        if brokerName in self._brokers:
+            self._brokers[brokerName].clearMessages(destination)
+    
+    def setMessageHandler(self, brokerName, destination, handler):
+        '''
+            Call handler(headers, body) for every message received
+            for selected broker and destination
+        '''
+        if brokerName in self._brokers:
+            self._brokers[brokerName].setMessageHandler(destination, handler)
+    
     def getErrors(self, brokerName, destination):
         '''
             Get all errors for selected broker and destination
@@ -419,19 +1044,113 @@ class MultipleProducerConsumer:
         else:
             assert 0==1 , ('Broker session not established')
     
-    def sendMessage(self, brokerName, destination, headers, body):
+    def sendMessage(self, brokerName, destination, headers, body, via=None, timeout=5, measured=True):
         '''
-            Send a message to the selected broker and destination
+            Send a message to the selected broker and destination,
+            optionally on the connection of the via destination,
+            connecting within timeout, see BrokerItem.sendMessage
         '''
         if brokerName in self._brokers:
             log.info('Sending message to %s on broker %s' % (destination, brokerName))
+            if self._run_id:
+                headers = dict({'expires': int((time.time() + self._run_expiry) * 1000)}, **headers)
+                headers[MONITOR_RUN_HEADER] = self._run_id
             self._brokers[brokerName].sendMessage(destination,
                                                   headers, 
-                                                  body)
+                                                  body,
+                                                  via,
+                                                  timeout,
+                                                  measured)
             return True
         log.info('No broker with name %s' % brokerName)
         return False
     
+    def sweepPayloads(self, brokerName, destination, consumers, sizes, number, timer):
+        '''
+            Send number messages of each payload size from brokerName and
+            wait for them on every (broker, destination) in consumers.
+            Return a PayloadResult per size, raise AssertionError on
+            corrupted payloads.
+        '''
+        pool = PayloadPool(sizes)
+        results = []
+        for size in pool.sizes:
+            for consumer, consumerDestination in consumers:
+                self.clearMessages(consumer, consumerDestination)
+            headers = dict(pool.headers(size), persistent='true')
+            body = pool.body(size)
+            start = timer.time()
+            for i in range(number):
+                headers['receipt'] = self.receiptId()
+                # large bodies take long to write, not a sign of flow control
+                self.sendMessage(brokerName, destination, headers, body,
+                                 timeout=timer.left, measured=False)
+            self.waitForMessagesToBeSent(brokerName, destination, timer.left)
+            received = corrupted = 0
+            for consumer, consumerDestination in consumers:
+                self.waitForMessagesToArrive(consumer, consumerDestination, number, timer.left)
+                messages = self.getMessages(consumer, consumerDestination)
+                received += len(messages)
+                corrupted += len([m for m in messages if not pool.verify(m)])
+            result = PayloadResult(size, number * len(consumers), received,
+                                   corrupted, timer.time() - start)
+            log.info('Payload %s' % result)
+            results.append(result)
+            assert corrupted == 0, ('%d of %d messages of %s corrupted on %s' \
+                                    % (corrupted, received, formatSize(size), destination))
+        return results
+    
+    def receiptId(self):
+        '''
+            Unique receipt id for a message sent in this run
+        '''
+        self._receipt_counter += 1
+        return 'receipt-%d-%d' % (os.getpid(), self._receipt_counter)
+    
+    def setFlowControlThreshold(self, threshold):
+        '''
+            Sends or receipts slower than threshold seconds count as stalled
+        '''
+        self._flow_control_threshold = threshold
+        for b in self._brokers.values():
+            b.setFlowControlThreshold(threshold)
+    
+    def getSendStats(self):
+        '''
+            Return SendStats aggregated over all brokers
+        '''
+        stats = SendStats(self._flow_control_threshold)
+        for b in self._brokers.values():
+            stats.merge(b.getSendStats())
+        return stats
+    
+    def setFailover(self, enabled):
+        '''
+            Reconnect and subscribe again when a broker drops a connection
+            during the run [default], instead of waiting until timeout
+        '''
+        self._failover = enabled
+        for b in self._brokers.values():
+            b.setFailover(enabled)
+    
+    def getFailoverStats(self):
+        '''
+            Return FailoverStats aggregated over all brokers
+        '''
+        stats = FailoverStats()
+        for b in self._brokers.values():
+            stats.merge(b.getFailoverStats())
+        return stats
+    
+    def getConnectStats(self):
+        '''
+            Return ConnectStats aggregated over all brokers
+        '''
+        stats = ConnectStats()
+        for b in self._brokers.values():
+            stats.merge(b.getConnectStats())
+        return stats
+    
     def destroyAllBrokers(self):
         '''
             Delete all broker items
@@ -509,11 +1228,32 @@ class MultipleProducerConsumer:
         '''
             start action
         '''
-        self.run()
+        self.snapshotResources('start')
+        if self._profiler:
+            self._profiler.begin('run')
+        try:
+            self.run()
+            if self._scheduler:
+                self._scheduler.end()
+        except TimeoutException:
+            if self._scheduler:
+                self._scheduler.fail('timeout')
+            raise
+        except Exception:
+            if self._scheduler:
+                self._scheduler.fail('failed')
+            raise
+        finally:
+            self.snapshotResources('run')
     
     def stop(self):
         '''
             stop action
         '''
+        if self._profiler:
+            self._profiler.begin('stop')
         self.destroyAllBrokers()
+        if self._profiler:
+            self._profiler.end()
+        self.snapshotResources('stop')
     
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+import socket
+import threading
+import time
+from MultipleProducerConsumer import MultipleProducerConsumer, TimeoutException
+from utils.Stats import summary
+from utils.Timer import Timer
+
+import logging
+logging.basicConfig()
+log = logging.getLogger("Ping")
+
+PING_HEADER = 'monitor.ping'
+PING_SEQ_HEADER = PING_HEADER + '.seq'
+PING_SENT_HEADER = PING_HEADER + '.sent'
+PING_RECEIVED_HEADER = PING_HEADER + '.received'
+PING_REPLIED_HEADER = PING_HEADER + '.replied'
+PING_RESPONDER_HEADER = PING_HEADER + '.responder'
+PING_REPLY_DESTINATION = '/temp-queue/monitor.ping'
+PING_EXPIRY_TIME = 60 * 1000 # 1 minute
+
+class PingResponder(MultipleProducerConsumer):
+    '''
+        Echo service, answers every ping on its reply-to destination
+        stamping the time it was received and replied
+    '''
+
+    def __init__(self, brokerName, brokerHost,
+                 destination='/queue/monitor.test.ping',
+                 duration=None,
+                 hostcert=None,
+                 hostkey=None,
+                 port=6163,
+                 responderid=None,
+                 timeout=15,
+                 **opts):
+        MultipleProducerConsumer.__init__(self)
+
+        self.brokerName = brokerName
+        self.brokerHost = brokerHost
+        self.destination = destination
+        self.duration = duration
+        self.hostcert = hostcert
+        self.hostkey = hostkey
+        self.port = port
+        self.responderid = responderid or socket.getfqdn()
+        self.timeout = timeout
+
+        self.replied = 0
+
+    def setup(self):
+
+        if self.hostcert and self.hostkey:
+            self.setSSLAuthentication(self.hostcert, self.hostkey)
+        self.createBroker(self.brokerName, self.brokerHost, self.port)
+
+    def run(self):
+
+        timer = Timer(self.timeout)
+
+        ''' Starting consumer, replies are sent from the receiver thread '''
+        self.createConsumer(self.brokerName, self.destination, timer.left)
+        self.setMessageHandler(self.brokerName, self.destination, self.reply)
+
+        started = time.time()
+        while self.duration is None or time.time() - started < self.duration:
+            time.sleep(1)
+        log.info('Replied to %d pings' % self.replied)
+
+    def reply(self, headers, body):
+        received = time.time()
+        if PING_SEQ_HEADER not in headers or 'reply-to' not in headers:
+            return
+        self.sendMessage(self.brokerName,
+                         headers['reply-to'],
+                         {'persistent':'false',
+                          PING_SEQ_HEADER:headers[PING_SEQ_HEADER],
+                          PING_SENT_HEADER:headers.get(PING_SENT_HEADER, ''),
+                          PING_RECEIVED_HEADER:'%f' % received,
+                          PING_RESPONDER_HEADER:self.responderid,
+                          PING_REPLIED_HEADER:'%f' % time.time()},
+                         '',
+                         via=self.destination)
+        self.replied += 1
+
+class PingTest(MultipleProducerConsumer):
+    '''
+        Round trip time of non-persistent pings answered by a PingResponder
+        through a temporary queue, all on one connection
+    '''
+
+    def __init__(self, brokerName, brokerHost,
+                 count=10,
+                 destination='/queue/monitor.test.ping',
+                 hostcert=None,
+                 hostkey=None,
+                 interval=0.2,
+                 port=6163,
+                 replytimeout=2,
+                 timeout=15,
+                 **opts):
+        MultipleProducerConsumer.__init__(self)
+
+        self.brokerName = brokerName
+        self.brokerHost = brokerHost
+        self.count = count
+        self.destination = destination
+        self.hostcert = hostcert
+        self.hostkey = hostkey
+        self.interval = interval
+        self.port = port
+        self.replytimeout = replytimeout
+        self.timeout = timeout
+
+        self.replies = dict()
+        self.samples = []
+        self.lost = 0
+        self._arrived = threading.Event()
+
+    def setup(self):
+
+        if self.hostcert and self.hostkey:
+            self.setSSLAuthentication(self.hostcert, self.hostkey)
+        self.createBroker(self.brokerName, self.brokerHost, self.port)
+
+    def run(self):
+
+        timer = Timer(self.timeout)
+
+        ''' Starting consumer on the temporary reply queue '''
+        self.createConsumer(self.brokerName, PING_REPLY_DESTINATION, timer.left)
+        self.setMessageHandler(self.brokerName, PING_REPLY_DESTINATION, self.collect)
+
+        ''' Sending pings on the same connection, one at a time '''
+        for seq in range(self.count):
+            if timer.left <= 0:
+                self.lost += self.count - seq
+                break
+            sent = timer.time()
+            self.sendMessage(self.brokerName,
+                             self.destination,
+                             {'expires':int(sent * 1000 + PING_EXPIRY_TIME),
+                              'persistent':'false',
+                              'reply-to':PING_REPLY_DESTINATION,
+                              PING_SEQ_HEADER:'%d' % seq,
+                              PING_SENT_HEADER:'%f' % sent},
+                             '',
+                             via=PING_REPLY_DESTINATION,
+                             timeout=timer.left)
+            reply = self.waitForReply('%d' % seq, min(self.replytimeout, timer.left))
+            if reply is None:
+                self.lost += 1
+                continue
+            headers, arrived = reply
+            try:
+                self.samples.append((sent,
+                                     float(headers[PING_RECEIVED_HEADER]),
+                                     float(headers[PING_REPLIED_HEADER]),
+                                     arrived,
+                                     headers.get(PING_RESPONDER_HEADER, '')))
+            except (KeyError, ValueError):
+                self.samples.append((sent, None, None, arrived, ''))
+            timer.sleep(max(0, self.interval - (timer.time() - sent)))
+
+        if not self.samples:
+            raise TimeoutException('no reply to %d pings on %s from broker %s' % (self.count, self.destination, self.brokerHost))
+
+    def collect(self, headers, body):
+        if PING_SEQ_HEADER in headers:
+            self.replies[headers[PING_SEQ_HEADER]] = (headers, time.time())
+            self._arrived.set()
+
+    def waitForReply(self, seq, timeout):
+        '''
+            Wait for the reply to a ping, a late reply to an earlier ping
+            does not count. The arrival time is taken by the receiver
+            thread, waking up late here does not change the round trip.
+        '''
+        deadline = time.time() + timeout
+        while seq not in self.replies:
+            left = deadline - time.time()
+            if left <= 0:
+                break
+            self._arrived.wait(left)
+            self._arrived.clear()
+        return self.replies.get(seq, None)
+
+    def getRtts(self):
+        return [s[3] - s[0] for s in self.samples]
+    rtts = property(getRtts)
+
+    def getSummary(self):
+        '''
+            min, avg, p50, p90, p99, max and jitter of the round trip times
+        '''
+        return summary(self.rtts)
+
+if __name__ == '__main__':
+
+    log.setLevel(logging.INFO)
+    logging.getLogger('MultipleProducerConsumer').setLevel(logging.INFO)
+    broker = 'vtb26'
+    brokerHost = 'vtb-generic-26.cern.ch'
+
+    pt = PingTest(broker, brokerHost, port=6163)
+    pt.setup()
+    try:
+        pt.start()
+    except KeyboardInterrupt:
+        print "keyboard interrupt"
+    except TimeoutException, e:
+        print '%s' % e
+    pt.stop()
+
+    for k, v in sorted(pt.getSummary().items()):
+        print '%s: %.2fms' % (k, v * 1000)
+    print 'lost: %d' % pt.lost
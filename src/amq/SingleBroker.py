@@ -6,15 +6,18 @@
 import os
 from MultipleProducerConsumer import MultipleProducerConsumer, TimeoutException
 import time
-from utils.Timer import Timer
 
 import logging
 logging.basicConfig()
 log = logging.getLogger(__file__)
 
+''' Share of the timeout kept for each phase while the earlier ones run '''
+PHASES = [('connect', 0.0), ('send', 0.1), ('receive', 0.15)]
+PAYLOAD_PHASES = [('connect', 0.0), ('payload', 0.25)]
+
 class StompTest(MultipleProducerConsumer):
     
-    def __init__(self, brokerName, brokerHost, port=6163, destination='/queue/test.topic', hostcert=None, hostkey=None, timeout=15, messages=1):
+    def __init__(self, brokerName, brokerHost, port=6163, destination='/queue/test.topic', hostcert=None, hostkey=None, timeout=15, messages=1, payloadSizes=None, drain=False):
         MultipleProducerConsumer.__init__(self)
         
         self.brokerName = brokerName
@@ -25,39 +28,59 @@ class StompTest(MultipleProducerConsumer):
         self.hostkey = hostkey
         self.timeout = timeout
         self.messages = messages
+        self.payloadSizes = payloadSizes
+        self.payloadResults = []
+        self.drain = drain
         
     def setup(self):
         
         if self.hostcert and self.hostkey:
             self.setSSLAuthentication(self.hostcert, self.hostkey)
+        ''' Only this run's messages are delivered, leftovers are not counted '''
+        self.setRunId(timeout=self.timeout)
         self.createBroker(self.brokerName, self.brokerHost, self.port)
         
     def run(self):
         
-        timer = Timer(self.timeout)
+        timer = self.createScheduler(self.timeout, self.payloadSizes and PAYLOAD_PHASES or PHASES)
         
         ''' Starting consumer '''
-        self.createConsumer(self.brokerName, self.destination, timer.left)
+        timer.begin('connect')
+        if self.drain:
+            self.drainConsumer(self.brokerName, self.destination, timer.phaseLeft / 2)
+        self.createConsumer(self.brokerName, self.destination, timer.phaseLeft)
         if self.destination.startswith('/topic/'):
-            time.sleep(1)
+            timer.sleep(1)
         
         ''' Creating producer and sending a message '''
-        self.createProducer(self.brokerName, self.destination, timer.left)
+        self.createProducer(self.brokerName, self.destination, timer.phaseLeft)
+        if self.payloadSizes:
+            timer.begin('payload')
+            self.payloadResults = self.sweepPayloads(self.brokerName,
+                                                     self.destination,
+                                                     [(self.brokerName, self.destination)],
+                                                     self.payloadSizes,
+                                                     self.messages,
+                                                     timer)
+            self.completed(self.brokerName)
+            return
+        timer.begin('send')
         for i in range(self.messages):
             self.sendMessage(self.brokerName, 
                              self.destination, 
-                             {'persistent':'true'}, 
-                             'testing-%s' % i)
+                             {'persistent':'true',
+                              'receipt':self.receiptId()}, 
+                             'testing-%s' % i,
+                             timeout=timer.phaseLeft)
         self.waitForMessagesToBeSent(self.brokerName,
                                      self.destination,
-                                     timer.left)
+                                     timer.phaseLeft)
         
         ''' Ensuring that we received a message '''
-        self.waitForMessagesToArrive(self.brokerName, self.destination, self.messages, timer.left)
+        timer.begin('receive')
+        self.waitForMessagesToArrive(self.brokerName, self.destination, self.messages, timer.phaseLeft)
         self.assertMessagesNumber(self.brokerName, self.destination, self.messages)
-            
-    def stop(self):
-        self.destroyAllBrokers()
+        self.completed(self.brokerName)
 
 if __name__ == '__main__':
 
@@ -0,0 +1,83 @@
+import errno
+import fcntl
+import os
+import random
+import re
+import time
+
+import logging
+logging.basicConfig()
+log = logging.getLogger('Admission')
+
+class AdmissionScheduler(object):
+    '''
+        Host wide cap on concurrent connection attempts per broker. An
+        attempt takes one of the slot lock files of the broker in a shared
+        directory and holds it until connected. When none is free it waits
+        a random delay first, spreading the checks started together, then
+        polls the slots. Waiting is bounded by half the connection timeout,
+        after that the attempt goes ahead anyway with the other half.
+    '''
+
+    def __init__(self, directory='/var/tmp/nagios-plugins-activemq', slots=4, jitter=1.0):
+        self._directory = directory
+        self._slots = slots
+        self._jitter = jitter
+
+    def path(self, host, port, slot):
+        name = re.sub('[^A-Za-z0-9.-]', '_', '%s_%s' % (host, port))
+        return os.path.join(self._directory, '%s.slot%d' % (name, slot))
+
+    def tryAcquire(self, host, port):
+        '''
+            Return a free slot file locked, False if all are taken and
+            None if the directory is not usable
+        '''
+        slots = range(self._slots)
+        random.shuffle(slots)
+        for slot in slots:
+            try:
+                f = open(self.path(host, port, slot), 'a')
+            except IOError, e:
+                log.info('Admission disabled: %s' % e)
+                return None
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return f
+            except IOError, e:
+                f.close()
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+        return False
+
+    def acquire(self, host, port, timeout):
+        '''
+            Return the slot file held, None if the attempt was not
+            admitted in time or the directory is not usable
+        '''
+        # the connection keeps at least half of the budget
+        wait = timeout / 2.0
+        deadline = time.time() + wait
+        try:
+            if not os.path.isdir(self._directory):
+                os.makedirs(self._directory)
+        except OSError, e:
+            log.info('Admission disabled: %s' % e)
+            return None
+        slot = self.tryAcquire(host, port)
+        if slot is not False:
+            return slot
+        # all slots taken, spread the attempts before polling
+        time.sleep(random.uniform(0, min(self._jitter, wait / 2.0)))
+        while True:
+            slot = self.tryAcquire(host, port)
+            if slot is not False:
+                return slot
+            if time.time() >= deadline:
+                log.info('Not admitted to %s:%s after %.2f seconds, connecting anyway' % (host, port, wait))
+                return None
+            time.sleep(random.uniform(0.02, 0.1))
+
+    def release(self, slot):
+        if slot is not None:
+            slot.close()
@@ -0,0 +1,81 @@
+import json
+import time
+
+class ClockSkewEstimator(object):
+    '''
+        Offset of a remote clock from the local one, estimated NTP style
+        from pings answered by a remote host: t0 local send, t1 remote
+        receive, t2 remote reply, t3 local receive. The offset of each
+        host pair is smoothed across runs and kept in a state file.
+    '''
+
+    def __init__(self, statefile=None, alpha=0.3):
+        self._statefile = statefile
+        self._alpha = alpha
+        self._state = dict()
+        self.load()
+
+    def offset(self, sample):
+        '''
+            Return (offset, error bound) of one sample, remote minus local
+        '''
+        t0, t1, t2, t3 = sample[:4]
+        return ((t1 - t0) + (t2 - t3)) / 2.0, ((t3 - t0) - (t2 - t1)) / 2.0
+
+    def update(self, pair, samples):
+        '''
+            Fold the sample with the shortest round trip, the least
+            disturbed by queueing, into the smoothed offset of the pair
+        '''
+        samples = [s for s in samples if s[1] is not None and s[2] is not None]
+        if not samples:
+            return self.get(pair)
+        best = min(samples, key=lambda s: (s[3] - s[0]) - (s[2] - s[1]))
+        offset, bound = self.offset(best)
+        previous = self._state.get(pair)
+        if previous:
+            step = abs(offset - previous['offset'])
+            offset = self._alpha * offset + (1 - self._alpha) * previous['offset']
+            # the smoothed value can be wrong by the jump it absorbed
+            bound = max(bound, (1 - self._alpha) * step)
+        self._state[pair] = {'offset': offset, 'bound': bound, 'time': time.time()}
+        self.save()
+        return offset, bound
+
+    def get(self, pair):
+        '''
+            Return (offset, error bound) of the pair, None if never measured
+        '''
+        if pair not in self._state:
+            return None
+        return self._state[pair]['offset'], self._state[pair]['bound']
+
+    def correct(self, pair, remoteTime):
+        '''
+            Convert a remote timestamp to local time
+        '''
+        estimate = self.get(pair)
+        if estimate is None:
+            return remoteTime
+        return remoteTime - estimate[0]
+
+    def load(self):
+        if not self._statefile:
+            return
+        try:
+            f = open(self._statefile, 'r')
+            try:
+                self._state = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            self._state = dict()
+
+    def save(self):
+        if not self._statefile:
+            return
+        f = open(self._statefile, 'w')
+        try:
+            json.dump(self._state, f)
+        finally:
+            f.close()
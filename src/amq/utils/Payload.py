@@ -0,0 +1,96 @@
+import zlib
+
+PAYLOAD_SIZE_HEADER = 'monitor.payload.size'
+PAYLOAD_CRC_HEADER = 'monitor.payload.crc'
+CHUNK_SIZE = 64 * 1024
+UNITS = {'': 1, 'B': 1, 'K': 1024, 'M': 1024 * 1024}
+
+def parseSize(value):
+    '''
+        Convert sizes like 512, 1K or 10M to bytes
+    '''
+    value = value.strip().upper()
+    unit = value.lstrip('0123456789')
+    if unit not in UNITS or unit == value:
+        raise ValueError('invalid payload size: %s' % value)
+    return int(value[:len(value) - len(unit)]) * UNITS[unit]
+
+def parseSizes(value):
+    return [parseSize(v) for v in value.split(',') if v.strip()]
+
+def formatSize(size):
+    for unit in ('M', 'K'):
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return '%d%s' % (size / UNITS[unit], unit)
+    return '%d' % size
+
+def checksum(body):
+    '''
+        CRC32 of the body computed chunk by chunk without copying it
+    '''
+    crc = 0
+    for offset in xrange(0, len(body), CHUNK_SIZE):
+        crc = zlib.crc32(buffer(body, offset, CHUNK_SIZE), crc)
+    return crc & 0xffffffff
+
+class PayloadPool(object):
+    '''
+        Message bodies for each size, allocated once and reused for
+        every message sent
+    '''
+
+    def __init__(self, sizes):
+        self._sizes = sorted(set(sizes))
+        self._bodies = dict()
+        self._checksums = dict()
+        # printable pattern, STOMP frames are terminated by NUL
+        pattern = ''.join([chr(c) for c in range(33, 127)])
+        largest = self._sizes and self._sizes[-1] or 0
+        data = pattern * (largest / len(pattern) + 1)
+        for size in self._sizes:
+            self._bodies[size] = data[:size]
+            self._checksums[size] = checksum(self._bodies[size])
+
+    def sizes(self):
+        return self._sizes
+    sizes = property(sizes)
+
+    def body(self, size):
+        return self._bodies[size]
+
+    def headers(self, size):
+        return {PAYLOAD_SIZE_HEADER: '%d' % size,
+                PAYLOAD_CRC_HEADER: '%d' % self._checksums[size]}
+
+    def verify(self, message):
+        '''
+            Check that a received message carries the body it was sent with
+        '''
+        headers = message.headers
+        try:
+            size = int(headers[PAYLOAD_SIZE_HEADER])
+            crc = int(headers[PAYLOAD_CRC_HEADER])
+        except (KeyError, ValueError):
+            return False
+        return message.length == size and message.digest == crc
+
+class PayloadResult(object):
+
+    def __init__(self, size, sent, received, corrupted, elapsed):
+        self.size = size
+        self.sent = sent
+        self.received = received
+        self.corrupted = corrupted
+        self.elapsed = elapsed
+
+    def throughput(self):
+        '''
+            MB/s for the messages received intact
+        '''
+        if self.elapsed <= 0:
+            return 0.0
+        return (self.received - self.corrupted) * self.size / self.elapsed / UNITS['M']
+    throughput = property(throughput)
+
+    def __str__(self):
+        return '%s %.2fMB/s' % (formatSize(self.size), self.throughput)
@@ -0,0 +1,107 @@
+from Timer import Timer
+
+class Phase(object):
+
+    def __init__(self, name, budget, start):
+        self.name = name
+        self.budget = budget
+        self.start = start
+        self.stop = None
+        self.status = 'running'
+
+    def elapsed(self):
+        return (self.stop or self.start) - self.start
+    elapsed = property(elapsed)
+
+    def __str__(self):
+        return '%s %.2fs %s' % (self.name, self.elapsed, self.status)
+
+class PhaseScheduler(Timer):
+    '''
+        Timer splitting the overall budget between named phases. Each
+        phase keeps a share of the timeout for itself while the earlier
+        phases run, a phase gets what is left but the shares of the
+        phases after it, so time not used by a phase goes to the next.
+        A run whose result is known before the last phase can be marked
+        decided, the waits then stop early.
+    '''
+
+    def __init__(self, timeout, reserves=None):
+        Timer.__init__(self, timeout)
+        self._reserves = list(reserves or [])
+        self._phases = []
+        self._current = None
+        self._decided = None
+
+    def budget(self, name):
+        '''
+            Seconds available to the phase if it began now
+        '''
+        names = [n for n, r in self._reserves]
+        if name not in names:
+            return self.left
+        started = [p.name for p in self._phases]
+        later = [r for n, r in self._reserves[names.index(name) + 1:] if n not in started]
+        return max(0, self.left - self._timeout * sum(later, 0.0))
+
+    def begin(self, name):
+        '''
+            End the current phase and begin the next one, return its budget
+        '''
+        self.end()
+        budget = self.budget(name)
+        self._current = Phase(name, budget, self.time())
+        self._phases.append(self._current)
+        return budget
+
+    def end(self, status='ok'):
+        if self._current:
+            self._current.stop = self.time()
+            self._current.status = status
+            self._current = None
+
+    def fail(self, status='timeout'):
+        self.end(status)
+
+    def phaseLeft(self):
+        '''
+            Seconds left to the current phase
+        '''
+        if not self._current:
+            return self.left
+        return max(0, min(self.left, self._current.budget - (self.time() - self._current.start)))
+
+    def phases(self):
+        return list(self._phases)
+
+    def finished(self):
+        return [p.name for p in self._phases if p.status == 'ok']
+
+    def pending(self):
+        started = [p.name for p in self._phases]
+        return [n for n, r in self._reserves if n not in started]
+
+    def decide(self, reason):
+        '''
+            Mark the overall result as known, the phases left are skipped
+        '''
+        if self._decided is None:
+            self._decided = reason
+
+    def decided(self):
+        return self._decided
+
+    def report(self):
+        '''
+            Where the time went, e.g. "connect 0.12s ok, receive 4.00s timeout, not started: check"
+        '''
+        items = ['%s' % p for p in self._phases]
+        if self._decided:
+            items.append('decided early: %s' % self._decided)
+        if self.pending():
+            items.append('not started: %s' % ', '.join(self.pending()))
+        return ', '.join(items)
+
+    phaseLeft = property(phaseLeft)
+    phases = property(phases)
+    decided = property(decided)
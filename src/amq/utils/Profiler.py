@@ -0,0 +1,121 @@
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+
+class Profiler(object):
+    '''
+        cProfile the check phase by phase and write a JSON summary with
+        wall time, CPU time and the most expensive functions of each phase.
+        Wall time not spent on CPU is mostly time waiting for the broker.
+        Threads started while profiling, e.g. the stomp receiver running
+        the Listener, get a cProfile of their own, the functions they ran
+        during a phase are listed apart from the ones of the main thread.
+    '''
+
+    def __init__(self, top=15):
+        self._top = top
+        self._phases = []
+        self._current = None
+        self._lock = threading.Lock()
+        self._threads = []
+        self._threadStats = dict()
+
+    def record(self, name, wall, cpu=None):
+        '''
+            Add a phase measured elsewhere, e.g. interpreter startup
+        '''
+        self._phases.append({'name': name, 'wall': wall, 'cpu': cpu, 'functions': [], 'thread_functions': []})
+
+    def begin(self, name):
+        self.end()
+        profile = cProfile.Profile()
+        self._current = (name, profile, time.time(), self.cpu())
+        threading.setprofile(self.profileThread)
+        profile.enable()
+
+    def end(self):
+        if not self._current:
+            return
+        name, profile, wall, cpu = self._current
+        profile.disable()
+        threading.setprofile(None)
+        self._current = None
+        stats = pstats.Stats(profile).stats
+        self._phases.append({'name': name,
+                             'wall': time.time() - wall,
+                             'cpu': self.cpu() - cpu,
+                             'functions': self.topFunctions(stats),
+                             'thread_functions': self.topFunctions(self.threadStats())})
+
+    def profileThread(self, frame, event, arg):
+        '''
+            Profile hook of a thread starting while profiling, on the
+            first call it is replaced by a cProfile of the thread
+        '''
+        profile = cProfile.Profile()
+        self._lock.acquire()
+        try:
+            self._threads.append(profile)
+        finally:
+            self._lock.release()
+        profile.enable()
+
+    def threadStats(self):
+        '''
+            Calls and times of the other threads since the last call, in
+            the pstats layout without callers
+        '''
+        self._lock.acquire()
+        try:
+            profiles = list(self._threads)
+        finally:
+            self._lock.release()
+        delta = dict()
+        for profile in profiles:
+            # a snapshot, the profile of a running thread cannot be disabled from here
+            profile.snapshot_stats()
+            previous = self._threadStats.get(id(profile), dict())
+            for function, (cc, nc, tt, ct, callers) in profile.stats.items():
+                pcc, pnc, ptt, pct = previous.get(function, (0, 0, 0.0, 0.0))
+                if nc > pnc:
+                    dcc, dnc, dtt, dct, dcallers = delta.get(function, (0, 0, 0.0, 0.0, None))
+                    delta[function] = (dcc + cc - pcc, dnc + nc - pnc, dtt + tt - ptt, dct + ct - pct, None)
+            self._threadStats[id(profile)] = dict([(f, s[:4]) for f, s in profile.stats.items()])
+        return delta
+
+    def cpu(self):
+        t = os.times()
+        return t[0] + t[1]
+
+    def topFunctions(self, stats):
+        functions = []
+        for (filename, line, function), (cc, nc, tt, ct, callers) in stats.items():
+            functions.append({'function': '%s:%d(%s)' % (filename, line, function),
+                              'calls': nc,
+                              'tottime': tt,
+                              'cumtime': ct})
+        functions.sort(key=lambda f: f['cumtime'], reverse=True)
+        return functions[:self._top]
+
+    def phases(self):
+        return list(self._phases)
+    phases = property(phases)
+
+    def summary(self):
+        self.end()
+        return {'pid': os.getpid(),
+                'time': time.time(),
+                'wall': sum([p['wall'] for p in self._phases]),
+                'cpu': sum([p['cpu'] or 0.0 for p in self._phases]),
+                'threads': len(self._threads),
+                'phases': self._phases}
+
+    def write(self, path):
+        f = open(path, 'w')
+        try:
+            json.dump(self.summary(), f, indent=1)
+        finally:
+            f.close()
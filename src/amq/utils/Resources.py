@@ -0,0 +1,159 @@
+import os
+import resource
+import threading
+import time
+
+PROC_FD = '/proc/self/fd'
+PROC_STATM = '/proc/self/statm'
+
+class ResourceSnapshot(object):
+    '''
+        Threads, open file descriptors, sockets, RSS and CPU time
+        of the current process at a given moment
+    '''
+
+    def __init__(self, phase=None):
+        self._phase = phase
+        self._time = time.time()
+        self._threads = [(t.ident, t.getName()) for t in threading.enumerate()]
+        self._fds, self._sockets = self.countFds()
+        self._rss = self.readRss()
+        t = os.times()
+        self._cpu = t[0] + t[1]
+
+    def countFds(self):
+        '''
+            Return (open fds, open sockets), None if /proc is not available
+        '''
+        try:
+            fds = os.listdir(PROC_FD)
+        except OSError:
+            return None, None
+        sockets = 0
+        for fd in fds:
+            try:
+                if os.readlink(os.path.join(PROC_FD, fd)).startswith('socket:'):
+                    sockets += 1
+            except OSError:
+                # fd closed while listing, or the listdir fd itself
+                pass
+        return len(fds), sockets
+
+    def readRss(self):
+        '''
+            Return the resident set size in KB
+        '''
+        try:
+            f = open(PROC_STATM, 'r')
+            try:
+                pages = int(f.read().split()[1])
+            finally:
+                f.close()
+            return pages * resource.getpagesize() / 1024
+        except (IOError, IndexError, ValueError):
+            # peak instead of current RSS, better than nothing
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def phase(self):
+        return self._phase
+
+    def time(self):
+        return self._time
+
+    def threads(self):
+        return self._threads
+
+    def threadCount(self):
+        return len(self._threads)
+
+    def fds(self):
+        return self._fds
+
+    def sockets(self):
+        return self._sockets
+
+    def rss(self):
+        return self._rss
+
+    def cpu(self):
+        return self._cpu
+
+    def __str__(self):
+        return '%s: threads=%d fds=%s sockets=%s rss=%sKB cpu=%.2fs' % \
+                (self._phase, self.threadCount, self._fds, self._sockets, self._rss, self._cpu)
+
+    phase = property(phase)
+    time = property(time)
+    threads = property(threads)
+    threadCount = property(threadCount)
+    fds = property(fds)
+    sockets = property(sockets)
+    rss = property(rss)
+    cpu = property(cpu)
+
+class ResourceMonitor(object):
+    '''
+        Collects snapshots around the check phases and compares them
+        to find threads and sockets left behind
+    '''
+
+    def __init__(self):
+        self._snapshots = []
+
+    def snapshot(self, phase):
+        s = ResourceSnapshot(phase)
+        self._snapshots.append(s)
+        return s
+
+    def get(self, phase):
+        for s in self._snapshots:
+            if s.phase == phase:
+                return s
+        return None
+
+    def snapshots(self):
+        return list(self._snapshots)
+    snapshots = property(snapshots)
+
+    def leaks(self, before='start', after='stop', grace=1.0):
+        '''
+            Return (leaked thread names, leaked sockets) between two phases.
+            Threads still shutting down get up to grace seconds to exit
+            before the after snapshot is retaken.
+        '''
+        first = self.get(before)
+        last = self.get(after)
+        if first is None or last is None:
+            return [], 0
+        known = set(ident for ident, name in first.threads)
+        deadline = time.time() + grace
+        while True:
+            alive = [t for t in threading.enumerate() if t.ident not in known]
+            if not alive or time.time() >= deadline:
+                break
+            time.sleep(0.1)
+        # retake the after snapshot once the exiting threads have settled
+        last = ResourceSnapshot(after)
+        self._snapshots = [s for s in self._snapshots if s.phase != after] + [last]
+        threads = [t.getName() for t in alive]
+        sockets = 0
+        if first.sockets is not None and last.sockets is not None:
+            sockets = max(last.sockets - first.sockets, 0)
+        return threads, sockets
+
+    def perfdata(self, phase='stop'):
+        '''
+            Return (label, value, uom) tuples for the given phase
+        '''
+        s = self.get(phase)
+        if s is None:
+            return []
+        start = self.get('start')
+        values = [('threads', s.threadCount, '')]
+        if s.fds is not None:
+            values.append(('fds', s.fds, ''))
+            values.append(('sockets', s.sockets, ''))
+        values.append(('rss', s.rss, 'KB'))
+        if start is not None:
+            values.append(('cpu', s.cpu - start.cpu, 's'))
+        return values
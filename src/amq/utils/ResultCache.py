@@ -0,0 +1,123 @@
+import errno
+import fcntl
+import hashlib
+import os
+import time
+
+import logging
+logging.basicConfig()
+log = logging.getLogger('ResultCache')
+
+class ResultCache(object):
+    '''
+        Share the result of a check between identical checks scheduled
+        close together. A check that finds a fresh result reuses it, a
+        check that starts while an identical one is running waits on the
+        file lock and then reuses the result it wrote.
+    '''
+
+    def __init__(self, directory='/var/tmp/nagios-plugins-activemq', ttl=30):
+        self._directory = directory
+        self._ttl = ttl
+
+    def key(self, *parts):
+        '''
+            Build a cache key from broker, port, destination, check type
+            and every other option changing the result
+        '''
+        return hashlib.sha1('|'.join(['%s' % p for p in parts])).hexdigest()
+
+    def secret(self, value):
+        '''
+            Digest of a credential for key(), so that checks with other
+            credentials do not share results and the credential itself
+            is never part of the key
+        '''
+        if value is None:
+            return None
+        return hashlib.sha1('secret|%s' % value).hexdigest()
+
+    def path(self, key, suffix):
+        return os.path.join(self._directory, '%s.%s' % (key, suffix))
+
+    def read(self, key):
+        '''
+            Return (exit_code, message) if a fresh result exists, None otherwise
+        '''
+        try:
+            f = open(self.path(key, 'result'), 'r')
+        except IOError:
+            return None
+        try:
+            header = f.readline().split()
+            message = f.read()
+        finally:
+            f.close()
+        try:
+            stored, exit_code = float(header[0]), int(header[1])
+        except (IndexError, ValueError):
+            return None
+        if time.time() - stored > self._ttl:
+            return None
+        return exit_code, message
+
+    def write(self, key, exit_code, message):
+        tmp = self.path(key, 'result.%d' % os.getpid())
+        f = open(tmp, 'w')
+        try:
+            f.write('%f %d\n%s' % (time.time(), exit_code, message))
+        finally:
+            f.close()
+        os.rename(tmp, self.path(key, 'result'))
+
+    def run(self, key, check, timeout=15):
+        '''
+            Return the (exit_code, message) of check(left), reusing a
+            fresh result or the result of an identical check already
+            running. Waiting for the lock is bounded by half of timeout,
+            after that the check runs anyway, with the seconds left of
+            timeout as argument.
+        '''
+        start = time.time()
+        result = self.read(key)
+        if result:
+            log.info('Reusing cached result %s' % key)
+            return result
+        try:
+            if not os.path.isdir(self._directory):
+                os.makedirs(self._directory)
+            lock = open(self.path(key, 'lock'), 'a')
+        except (IOError, OSError), e:
+            log.info('Result cache disabled: %s' % e)
+            return check(timeout - (time.time() - start))
+
+        try:
+            # the check keeps at least half of the budget
+            deadline = start + timeout / 2.0
+            locked = False
+            while not locked:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    locked = True
+                except IOError, e:
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                    if time.time() >= deadline:
+                        break
+                    time.sleep(0.1)
+
+            if locked:
+                # an identical check may have finished while we were waiting
+                result = self.read(key)
+                if result:
+                    log.info('Reusing result of concurrent check %s' % key)
+                    return result
+            exit_code, message = check(timeout - (time.time() - start))
+            if locked:
+                try:
+                    self.write(key, exit_code, message)
+                except (IOError, OSError), e:
+                    log.info('Cannot store result: %s' % e)
+            return exit_code, message
+        finally:
+            lock.close()
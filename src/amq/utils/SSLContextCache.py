@@ -0,0 +1,78 @@
+import ssl
+import threading
+
+class SSLContextCache(object):
+    '''
+        Stand-in for the ssl module of stomp.py. wrap_socket() uses one
+        SSLContext per certificate, key and verification settings, so the
+        key is loaded once per process instead of once per connection.
+        Without SSLContext (Python < 2.7.9) it falls back to ssl.wrap_socket.
+    '''
+
+    def __init__(self, module=ssl):
+        self._ssl = module
+        self._contexts = dict()
+        self._lock = threading.Lock()
+        self.handshakes = 0
+
+    def __getattr__(self, name):
+        # constants, exceptions and everything else come from ssl
+        return getattr(self._ssl, name)
+
+    def context(self, certfile=None, keyfile=None, cert_reqs=ssl.CERT_NONE, ca_certs=None, ssl_version=ssl.PROTOCOL_SSLv23):
+        key = (certfile, keyfile, cert_reqs, ca_certs, ssl_version)
+        self._lock.acquire()
+        try:
+            if key not in self._contexts:
+                context = self._ssl.SSLContext(ssl_version)
+                if certfile:
+                    context.load_cert_chain(certfile, keyfile)
+                if ca_certs:
+                    context.load_verify_locations(ca_certs)
+                context.verify_mode = cert_reqs
+                self._contexts[key] = context
+            return self._contexts[key]
+        finally:
+            self._lock.release()
+
+    def wrap_socket(self, sock, keyfile=None, certfile=None, server_side=False, cert_reqs=ssl.CERT_NONE, ssl_version=ssl.PROTOCOL_SSLv23, ca_certs=None, **kwargs):
+        self.handshakes += 1
+        if server_side or not hasattr(self._ssl, 'SSLContext'):
+            return self._ssl.wrap_socket(sock, keyfile, certfile, server_side, cert_reqs, ssl_version, ca_certs, **kwargs)
+        return self.context(certfile, keyfile, cert_reqs, ca_certs, ssl_version).wrap_socket(sock)
+
+_cache = None
+_lock = threading.Lock()
+_users = 0
+_original = None
+
+def withSSLContextCache(module, call, *args):
+    '''
+        Return call(*args) with the ssl module used by module, e.g.
+        stomp.connect, replaced by the process wide SSLContextCache.
+        The ssl module is put back when the last concurrent call returns,
+        the rest of the process keeps using the plain one.
+    '''
+    global _cache, _users, _original
+    _lock.acquire()
+    try:
+        if _cache is None:
+            _cache = SSLContextCache()
+        if _users == 0:
+            _original = getattr(module, 'ssl', None)
+            if _original is not None:
+                module.ssl = _cache
+        _users += 1
+    finally:
+        _lock.release()
+    try:
+        return call(*args)
+    finally:
+        _lock.acquire()
+        try:
+            _users -= 1
+            if _users == 0 and _original is not None:
+                module.ssl = _original
+                _original = None
+        finally:
+            _lock.release()
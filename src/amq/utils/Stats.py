@@ -0,0 +1,39 @@
+import math
+
+def mean(values):
+    if not values:
+        return 0.0
+    return sum(values, 0.0) / len(values)
+
+def percentile(values, p):
+    '''
+        Nearest-rank percentile, p between 0 and 100
+    '''
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    # smallest value with at least p percent of the values at or below it
+    rank = int(math.ceil(p * len(ordered) / 100.0)) - 1
+    return ordered[max(0, min(rank, len(ordered) - 1))]
+
+def jitter(values):
+    '''
+        Mean absolute difference between consecutive values
+    '''
+    if len(values) < 2:
+        return 0.0
+    return mean([abs(values[i] - values[i - 1]) for i in range(1, len(values))])
+
+def summary(values):
+    '''
+        Return a dict with min, avg, p50, p90, p99, max and jitter
+    '''
+    if not values:
+        return dict()
+    return {'min': min(values),
+            'avg': mean(values),
+            'p50': percentile(values, 50),
+            'p90': percentile(values, 90),
+            'p99': percentile(values, 99),
+            'max': max(values),
+            'jitter': jitter(values)}
@@ -1,6 +1,9 @@
 
-import commands
 import optparse
+
+import logging
+logging.basicConfig()
+log = logging.getLogger('amqprobesutils')
                                         
 class OptionParser (optparse.OptionParser):
     def check_required (self, opt):
@@ -9,5 +12,28 @@ class OptionParser (optparse.OptionParser):
         if getattr(self.values, option.dest) is None:
             self.error("%s option not supplied" % option)
             
-def uuidgen():
-    return commands.getoutput('uuidgen')
+def perfdata(values):
+    '''
+        Format a list of (label, value, uom) tuples as Nagios perfdata
+    '''
+    items = []
+    for label, value, uom in values:
+        if isinstance(value, float):
+            value = '%.3f' % value
+        items.append('%s=%s%s' % (label, value, uom))
+    return ' '.join(items)
+
+
+def resource_perfdata(probe, message):
+    '''
+        Add the threads and sockets leaked by a probe run with the
+        resource monitor enabled to message, return the message and
+        the resource and leak perfdata tuples
+    '''
+    threads, sockets = probe.getLeaks()
+    if threads or sockets:
+        message = '%s (leaked %d threads, %d sockets)' % (message, len(threads), sockets)
+        log.info('Leaked threads: %s' % ', '.join(threads))
+    perf = probe.getResourceMonitor().perfdata('stop')
+    perf += [('leaked_threads', len(threads), ''), ('leaked_sockets', sockets, '')]
+    return message, perf
@@ -0,0 +1,75 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'amq'))
+
+from utils.Admission import AdmissionScheduler
+
+class AdmissionSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.admission = AdmissionScheduler(os.path.join(self.directory, 'slots'), slots=2, jitter=0.5)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testFreeSlotIsTakenWithoutDelay(self):
+        start = time.time()
+        slot = self.admission.acquire('broker', 6163, 10)
+        self.assertNotEqual(slot, None)
+        self.assertTrue(time.time() - start < 0.1)
+        self.assertTrue(os.path.isdir(os.path.join(self.directory, 'slots')))
+        self.admission.release(slot)
+
+    def testSlotsAreDistinct(self):
+        first = self.admission.acquire('broker', 6163, 10)
+        second = self.admission.acquire('broker', 6163, 10)
+        self.assertNotEqual(first, None)
+        self.assertNotEqual(second, None)
+        self.assertNotEqual(first.name, second.name)
+        self.admission.release(first)
+        self.admission.release(second)
+
+    def testBrokersHaveTheirOwnSlots(self):
+        held = [self.admission.acquire('broker', 6163, 10) for i in range(2)]
+        other = self.admission.acquire('other', 6163, 1)
+        self.assertNotEqual(other, None)
+        self.assertTrue(other.name.startswith(os.path.join(self.directory, 'slots', 'other_6163')))
+        for slot in held + [other]:
+            self.admission.release(slot)
+
+    def testWaitIsCappedAtHalfTheBudget(self):
+        held = [self.admission.acquire('broker', 6163, 10) for i in range(2)]
+        start = time.time()
+        self.assertEqual(self.admission.acquire('broker', 6163, 1), None)
+        waited = time.time() - start
+        self.assertTrue(0.5 <= waited < 0.8, waited)
+        for slot in held:
+            self.admission.release(slot)
+
+    def testReleasedSlotIsReused(self):
+        held = [self.admission.acquire('broker', 6163, 10) for i in range(2)]
+        self.admission.release(held.pop())
+        slot = self.admission.acquire('broker', 6163, 1)
+        self.assertNotEqual(slot, None)
+        for slot in held + [slot]:
+            self.admission.release(slot)
+
+    def testPathIsSafe(self):
+        path = self.admission.path('../broker/x', 'port', 3)
+        self.assertEqual(os.path.dirname(path), os.path.join(self.directory, 'slots'))
+        self.assertTrue(path.endswith('.slot3'))
+
+    def testUnusableDirectoryDisablesAdmission(self):
+        blocker = os.path.join(self.directory, 'file')
+        open(blocker, 'w').close()
+        admission = AdmissionScheduler(os.path.join(blocker, 'slots'), slots=1, jitter=0)
+        self.assertEqual(admission.acquire('broker', 6163, 1), None)
+
+if __name__ == '__main__':
+    unittest.main()
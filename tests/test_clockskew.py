@@ -0,0 +1,81 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'amq'))
+
+from utils.ClockSkew import ClockSkewEstimator
+
+def sample(sent, skew, outbound, processing, inbound):
+    '''
+        Ping timestamps for a remote clock skew seconds ahead
+    '''
+    received = sent + outbound + skew
+    replied = received + processing
+    return (sent, received, replied, replied - skew + inbound)
+
+class ClockSkewTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.statefile = os.path.join(self.directory, 'skew.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertClose(self, expected, actual):
+        self.assertAlmostEqual(expected, actual, places=6)
+
+    def testSymmetricPathGivesExactOffset(self):
+        offset, bound = ClockSkewEstimator().offset(sample(100.0, 2.5, 0.01, 0.002, 0.01))
+        self.assertClose(2.5, offset)
+        self.assertClose(0.01, bound)
+
+    def testAsymmetricPathStaysWithinBound(self):
+        offset, bound = ClockSkewEstimator().offset(sample(100.0, -1.0, 0.05, 0.0, 0.01))
+        self.assertClose(0.03, bound)
+        self.assertTrue(abs(offset - (-1.0)) <= bound + 1e-9)
+
+    def testUpdatePicksShortestRoundTrip(self):
+        estimator = ClockSkewEstimator()
+        samples = [sample(100.0, 1.0, 0.5, 0.0, 0.1),
+                   sample(101.0, 1.0, 0.01, 0.0, 0.01),
+                   (102.0, None, None, 102.1)]
+        offset, bound = estimator.update('a|b', samples)
+        self.assertClose(1.0, offset)
+        self.assertClose(0.01, bound)
+
+    def testUpdateWithoutSamples(self):
+        estimator = ClockSkewEstimator()
+        self.assertEqual(None, estimator.update('a|b', [(1.0, None, None, 1.1)]))
+        self.assertEqual(None, estimator.get('a|b'))
+
+    def testSmoothing(self):
+        estimator = ClockSkewEstimator(alpha=0.5)
+        estimator.update('a|b', [sample(100.0, 1.0, 0.01, 0.0, 0.01)])
+        offset, bound = estimator.update('a|b', [sample(200.0, 3.0, 0.01, 0.0, 0.01)])
+        self.assertClose(2.0, offset)
+        # the smoothed offset may be off by the half of the jump it absorbed
+        self.assertClose(1.0, bound)
+
+    def testCorrect(self):
+        estimator = ClockSkewEstimator()
+        self.assertEqual(50.0, estimator.correct('a|b', 50.0))
+        estimator.update('a|b', [sample(100.0, 2.0, 0.01, 0.0, 0.01)])
+        self.assertClose(48.0, estimator.correct('a|b', 50.0))
+
+    def testStatePersists(self):
+        ClockSkewEstimator(self.statefile).update('a|b', [sample(100.0, 2.0, 0.01, 0.0, 0.01)])
+        offset, bound = ClockSkewEstimator(self.statefile).get('a|b')
+        self.assertClose(2.0, offset)
+
+    def testBrokenStateFile(self):
+        f = open(self.statefile, 'w')
+        f.write('{not json')
+        f.close()
+        self.assertEqual(None, ClockSkewEstimator(self.statefile).get('a|b'))
+
+if __name__ == '__main__':
+    unittest.main()
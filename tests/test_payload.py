@@ -0,0 +1,69 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'amq'))
+
+from MultipleProducerConsumer import Message, MessageFilter
+from utils.Payload import PayloadPool, PayloadResult, checksum, formatSize, parseSize, parseSizes
+
+class SizeTest(unittest.TestCase):
+
+    def testParseSize(self):
+        self.assertEqual(512, parseSize('512'))
+        self.assertEqual(512, parseSize('512B'))
+        self.assertEqual(1024, parseSize('1K'))
+        self.assertEqual(100 * 1024, parseSize(' 100k '))
+        self.assertEqual(10 * 1024 * 1024, parseSize('10M'))
+
+    def testParseSizeInvalid(self):
+        for value in ['', 'K', '1G', '1.5M', 'abc', '-1K']:
+            self.assertRaises(ValueError, parseSize, value)
+
+    def testParseSizes(self):
+        self.assertEqual([1024, 100 * 1024, 1024 * 1024], parseSizes('1K,100K,1M'))
+        self.assertEqual([1024], parseSizes('1K,'))
+
+    def testFormatSize(self):
+        self.assertEqual('512', formatSize(512))
+        self.assertEqual('1K', formatSize(1024))
+        self.assertEqual('1500', formatSize(1500))
+        self.assertEqual('1536K', formatSize(1536 * 1024))
+        self.assertEqual('10M', formatSize(10 * 1024 * 1024))
+
+    def testRoundTrip(self):
+        for value in ['1', '1K', '100K', '1M', '10M']:
+            self.assertEqual(value, formatSize(parseSize(value)))
+
+class PayloadPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = PayloadPool([100 * 1024, 1024, 1024])
+
+    def testSizes(self):
+        self.assertEqual([1024, 100 * 1024], self.pool.sizes)
+        self.assertEqual(1024, len(self.pool.body(1024)))
+        self.assertFalse('\0' in self.pool.body(100 * 1024))
+
+    def testChecksumInChunks(self):
+        import zlib
+        body = self.pool.body(100 * 1024)
+        self.assertEqual(zlib.crc32(body) & 0xffffffff, checksum(body))
+
+    def testVerify(self):
+        headers = self.pool.headers(1024)
+        body = self.pool.body(1024)
+        self.assertTrue(self.pool.verify(Message(headers, body)))
+        self.assertTrue(self.pool.verify(MessageFilter(digest=True)(headers, body)))
+        self.assertFalse(self.pool.verify(Message(headers, body[:-1] + '!')))
+        self.assertFalse(self.pool.verify(Message(headers, body[:-1])))
+        self.assertFalse(self.pool.verify(Message({}, body)))
+
+    def testThroughput(self):
+        result = PayloadResult(1024 * 1024, 10, 10, 2, 4.0)
+        self.assertEqual(2.0, result.throughput)
+        self.assertEqual('1M 2.00MB/s', '%s' % result)
+        self.assertEqual(0.0, PayloadResult(1024, 1, 1, 0, 0).throughput)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'amq'))
+
+from utils.PhaseScheduler import PhaseScheduler
+
+PHASES = [('connect', 0.0), ('send', 0.1), ('receive', 0.15)]
+
+class PhaseSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        self.scheduler = PhaseScheduler(20, PHASES)
+        self.scheduler.time = lambda: self.now
+        self.scheduler._startTime = self.now
+
+    def testFirstPhaseKeepsTheLaterReserves(self):
+        self.assertEqual(15.0, self.scheduler.begin('connect'))
+
+    def testUnusedTimeGoesToTheNextPhase(self):
+        self.scheduler.begin('connect')
+        self.now += 1
+        self.assertEqual(16.0, self.scheduler.begin('send'))
+        self.now += 1
+        self.assertEqual(18.0, self.scheduler.begin('receive'))
+
+    def testSkippedPhaseReleasesItsReserve(self):
+        self.scheduler.begin('connect')
+        self.assertEqual(20.0, self.scheduler.begin('receive'))
+
+    def testUnknownPhaseGetsWhatIsLeft(self):
+        self.scheduler.begin('connect')
+        self.now += 5
+        self.assertEqual(15.0, self.scheduler.begin('payload'))
+
+    def testPhaseLeft(self):
+        self.scheduler.begin('connect')
+        self.now += 14
+        self.assertEqual(1.0, self.scheduler.phaseLeft)
+        self.now += 2
+        self.assertEqual(0, self.scheduler.phaseLeft)
+
+    def testReport(self):
+        self.scheduler.begin('connect')
+        self.now += 0.5
+        self.scheduler.begin('send')
+        self.now += 3
+        self.scheduler.fail('timeout')
+        self.assertEqual(['connect'], self.scheduler.finished())
+        self.assertEqual('connect 0.50s ok, send 3.00s timeout, not started: receive', self.scheduler.report())
+
+    def testDecided(self):
+        self.assertEqual(None, self.scheduler.decided)
+        self.scheduler.decide('duplicates from a')
+        self.scheduler.decide('duplicates from b')
+        self.assertEqual('duplicates from a', self.scheduler.decided)
+        self.assertTrue('decided early: duplicates from a' in self.scheduler.report())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import fcntl
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'amq'))
+
+from utils.ResultCache import ResultCache
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ResultCache(self.directory, ttl=30)
+        self.key = self.cache.key('stomp', 'broker', 6163, '/queue/test')
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check(self, left):
+        self.calls.append(left)
+        return 0, 'OK - %d' % len(self.calls)
+
+    def testKeyDependsOnEveryPart(self):
+        self.assertEqual(self.key, self.cache.key('stomp', 'broker', 6163, '/queue/test'))
+        self.assertNotEqual(self.key, self.cache.key('stomp', 'broker', 6163, '/queue/test', True))
+
+    def testSecretHidesCredential(self):
+        self.assertEqual(None, self.cache.secret(None))
+        self.assertEqual(self.cache.secret('pwd'), self.cache.secret('pwd'))
+        self.assertNotEqual(self.cache.secret('pwd'), self.cache.secret('other'))
+        self.assertFalse('pwd' in self.cache.key('stomp', self.cache.secret('pwd')))
+
+    def testReadMissing(self):
+        self.assertEqual(None, self.cache.read(self.key))
+
+    def testWriteRead(self):
+        self.cache.write(self.key, 1, 'WARNING - slow | t=1s')
+        self.assertEqual((1, 'WARNING - slow | t=1s'), self.cache.read(self.key))
+
+    def testExpired(self):
+        self.cache.write(self.key, 0, 'OK')
+        self.cache._ttl = -1
+        self.assertEqual(None, self.cache.read(self.key))
+
+    def testRunReusesFreshResult(self):
+        self.assertEqual((0, 'OK - 1'), self.cache.run(self.key, self.check, 10))
+        self.assertEqual((0, 'OK - 1'), self.cache.run(self.key, self.check, 10))
+        self.assertEqual(1, len(self.calls))
+
+    def testRunAgainAfterTTL(self):
+        self.cache.run(self.key, self.check, 10)
+        self.cache._ttl = -1
+        self.assertEqual((0, 'OK - 2'), self.cache.run(self.key, self.check, 10))
+
+    def testCheckGetsTheWholeBudget(self):
+        self.cache.run(self.key, self.check, 10)
+        self.assertTrue(9 < self.calls[0] <= 10)
+
+    def testLockWaitLeavesHalfTheBudget(self):
+        lock = open(self.cache.path(self.key, 'lock'), 'a')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            start = time.time()
+            self.assertEqual((0, 'OK - 1'), self.cache.run(self.key, self.check, 1))
+        finally:
+            lock.close()
+        self.assertTrue(time.time() - start < 1)
+        self.assertTrue(0.3 < self.calls[0] <= 0.5)
+        # the result of a check that did not hold the lock is not stored
+        self.assertEqual(None, self.cache.read(self.key))
+
+    def testWaitsForConcurrentCheck(self):
+        lock = open(self.cache.path(self.key, 'lock'), 'a')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        def concurrent():
+            time.sleep(0.2)
+            self.cache.write(self.key, 2, 'CRITICAL - concurrent')
+            lock.close()
+        t = threading.Thread(target=concurrent)
+        t.start()
+        try:
+            self.assertEqual((2, 'CRITICAL - concurrent'), self.cache.run(self.key, self.check, 10))
+        finally:
+            t.join()
+        self.assertEqual([], self.calls)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'amq'))
+
+from utils.Stats import jitter, mean, percentile, summary
+
+class StatsTest(unittest.TestCase):
+
+    def testEmpty(self):
+        self.assertEqual(0.0, mean([]))
+        self.assertEqual(0.0, percentile([], 50))
+        self.assertEqual(0.0, jitter([1]))
+        self.assertEqual({}, summary([]))
+
+    def testNearestRank(self):
+        values = range(10, 0, -1)
+        self.assertEqual(1, percentile(values, 0))
+        self.assertEqual(1, percentile(values, 10))
+        self.assertEqual(2, percentile(values, 11))
+        self.assertEqual(5, percentile(values, 50))
+        self.assertEqual(7, percentile(values, 70))
+        self.assertEqual(9, percentile(values, 90))
+        self.assertEqual(10, percentile(values, 99))
+        self.assertEqual(10, percentile(values, 100))
+
+    def testNearestRankIsAValue(self):
+        values = [0.015, 0.020, 0.035, 0.050]
+        self.assertEqual(0.020, percentile(values, 50))
+        self.assertEqual(0.050, percentile(values, 90))
+        self.assertEqual(0.015, percentile([0.015], 99))
+
+    def testSummary(self):
+        result = summary([1.0, 3.0, 2.0])
+        self.assertEqual(1.0, result['min'])
+        self.assertEqual(2.0, result['avg'])
+        self.assertEqual(2.0, result['p50'])
+        self.assertEqual(3.0, result['p99'])
+        self.assertEqual(3.0, result['max'])
+        self.assertEqual(1.5, result['jitter'])
+
+if __name__ == '__main__':
+    unittest.main()